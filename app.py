@@ -3,6 +3,7 @@ import streamlit as st
 from google import genai
 from PIL import Image
 from datetime import datetime
+from workspaces import new_generation_workspace, sweep_idle_workspaces
 
 # 1. SETUP
 # Paste your Gemini API Key here
@@ -11,6 +12,15 @@ client = genai.Client(api_key=st.secrets["GEMINI_KEY"])
 # 2. USER INPUT & LOAD PHOTO
 st.title("AI Mechanical Engineer")
 
+# Per-session scratch folder so concurrent users don't overwrite each other's files.
+# Each run gets a fresh sub-folder and the previous one is removed; idle sessions are
+# swept at most every few minutes, the same way main.py does it.
+sweep_idle_workspaces()
+gen_dir = new_generation_workspace()
+sketch_path = os.path.join(gen_dir, "sketch.jpg")
+scad_path = os.path.join(gen_dir, "part.scad")
+stl_path = os.path.join(gen_dir, "part.stl")
+
 # Add the text input here
 user_prompt = st.text_input("What are we building?", placeholder="e.g., A 50mm cube with an M8 hole through the center")
 
@@ -20,8 +30,8 @@ try:
     
     if uploaded_file:
         img = Image.open(uploaded_file)
-        # We save it locally so the AI can process 'sketch.jpg' as per your original code
-        img.save("sketch.jpg")
+        # We save it to this session's workspace so the AI can process 'sketch.jpg' as per your original code
+        img.save(sketch_path)
     else:
         # Fallback for manual testing if no file is uploaded yet
         img = Image.open("sketch.jpg") 
@@ -35,19 +45,29 @@ print(f"Sending request: {user_prompt}")
 
 
 # 3a. DYNAMICALLY LOAD ALL LIBRARIES
-# This part looks into your folder and reads the text for the AI
+# This part looks into your folder and reads the text for the AI.
+# The result is cached for the whole process and only rebuilt when a library file changes.
 library_folder = "libraries"
-all_library_context = ""
-library_list = []
 
+@st.cache_data(show_spinner=False)
+def load_library_context(signature):
+    context = ""
+    for filename, _, _ in signature:
+        path = os.path.join(library_folder, filename)
+        with open(path, "r") as f:
+            # We wrap each file in a header so the AI doesn't get confused
+            context += f"\n--- LIBRARY: {filename} ---\n{f.read()}\n"
+    return context
+
+library_signature = []
 if os.path.exists(library_folder):
-    for filename in os.listdir(library_folder):
+    for filename in sorted(os.listdir(library_folder)):
         if filename.endswith(".scad"):
-            library_list.append(filename)
-            path = os.path.join(library_folder, filename)
-            with open(path, "r") as f:
-                # We wrap each file in a header so the AI doesn't get confused
-                all_library_context += f"\n--- LIBRARY: {filename} ---\n{f.read()}\n"
+            info = os.stat(os.path.join(library_folder, filename))
+            library_signature.append((filename, info.st_mtime_ns, info.st_size))
+
+library_list = [filename for filename, _, _ in library_signature]
+all_library_context = load_library_context(tuple(library_signature))
 
 # 3b. THE REQUEST
 # Updated with correct string formatting
@@ -91,7 +111,7 @@ clean_code = scad_code.replace("```openscad", "").replace("```scad", "").replace
 # Store the logic in a variable so you can use it for your 'Yes' button later
 print(f"AI LOGIC: {decoded_logic}")
 
-with open("part.scad", "w") as f:
+with open(scad_path, "w") as f:
     f.write(clean_code)
 
 # 5. RENDER TO STL
@@ -107,12 +127,13 @@ try:
     # Set the Environment to include your libraries folder
     # This fixes the "can't find include file" error on websites
     my_env = os.environ.copy()
-    my_env["OPENSCADPATH"] = os.path.join(current_dir, "libraries")
+    # part.scad sits in the workspace, so the app folder must be on the path for 'include <libraries/...>'
+    my_env["OPENSCADPATH"] = os.pathsep.join([current_dir, os.path.join(current_dir, "libraries")])
 
     # Run OpenSCAD
     # Note: We use 'openscad' instead of '/usr/bin/openscad' for web compatibility
     result = subprocess.run(
-        ['openscad', '-o', 'part.stl', 'part.scad'], 
+        ['openscad', '-o', stl_path, scad_path], 
         env=my_env,
         capture_output=True, 
         text=True, 
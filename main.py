@@ -6,10 +6,12 @@ from streamlit_stl import stl_from_file
 import json
 import re
 import os
+import sys
 import shutil
 import csv
 from datetime import datetime, timedelta
 import pandas as pd
+import numpy as np
 from streamlit_gsheets import GSheetsConnection
 from pydrive2.auth import GoogleAuth
 from pydrive2.drive import GoogleDrive
@@ -17,31 +19,515 @@ from oauth2client.service_account import ServiceAccountCredentials
 from PIL import Image
 import io
 import base64
+import hashlib
+import threading
+import time
+import atexit
+import sqlite3
+import tempfile
+import uuid
+import signal
+import math
+from collections import Counter, OrderedDict, deque
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from io import BytesIO
 import extra_streamlit_components as stx
+from workspaces import get_session_workspace, new_generation_workspace, sweep_idle_workspaces, workspace_file
 
 
 # Registry Spreadsheet
 conn = st.connection("gsheets", type=GSheetsConnection)
+REGISTRY_DOC_URL = "https://docs.google.com/spreadsheets/d/1ah2kXgEWyKqJktl9sapasqXQdShdgw0yB5qDR-9qX3A/edit"
+
+
+# --- SHEETS WRITE-BEHIND QUEUE ---
+# Every write used to read a whole worksheet, edit it in pandas and write it all back
+# from the script thread, so two clicks at once could overwrite each other's counters.
+# Writes are now queued as small ops (append / increment / update / delete) and a single
+# background thread applies everything queued for a worksheet in one read + one update.
+# GSheetsConnection only exposes whole-worksheet read/update, so that is the batch unit.
+#
+# A batch that fails is retried with exponential backoff and, after SHEET_MAX_RETRIES,
+# moved to a dead-letter list shown on the Admin page. An op that can't be applied at
+# all (e.g. an unknown column) is dead-lettered on its own so it can't block the sheet.
+SHEET_FLUSH_SECONDS = float(os.environ.get("NAPKIN_SHEET_FLUSH_SECONDS", 2))
+SHEET_RETRY_SECONDS = float(os.environ.get("NAPKIN_SHEET_RETRY_SECONDS", 5))
+SHEET_RETRY_MAX_SECONDS = 300
+SHEET_MAX_RETRIES = int(os.environ.get("NAPKIN_SHEET_MAX_RETRIES", 6))
+
+@st.cache_resource
+def get_sheet_writer():
+    writer = {
+        "lock": threading.Lock(),
+        "wake": threading.Event(),
+        "pending": {},        # (spreadsheet, worksheet) -> ops in arrival order
+        "inflight": {},       # Ops taken by the flush that aren't in the mirror yet
+        "retry": {},          # Failed batches: ops, attempts, next_at, and what the last update tried to write
+        "dead_letters": deque(maxlen=200),
+        "last_error": None,
+        "thread": None,
+    }
+    thread = threading.Thread(target=sheet_writer_loop, args=(writer, conn), name="napkin-sheets", daemon=True)
+    writer["thread"] = thread
+    thread.start()
+    # Drain whatever is still queued when the server shuts down
+    atexit.register(flush_sheet_writes, writer, conn, True)
+    return writer
+
+def sheet_column(df, name):
+    """Finds a column by its normalized (stripped, lowercase) name. A typo must not add a column to the shared sheet."""
+    wanted = name.strip().lower()
+    for col in df.columns:
+        if str(col).strip().lower() == wanted:
+            return col
+    raise KeyError(f"unknown column '{name}'")
+
+def sheet_cell_text(value):
+    """One text form per cell value, whichever way it came back (None from the mirror, NaN from Sheets, 3.0 for 3)."""
+    if pd.isna(value) or value == "":
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def sheet_row_mask(df, match):
+    mask = pd.Series(True, index=df.index)
+    for name, value in match.items():
+        col = sheet_column(df, name)
+        mask &= df[col].map(sheet_cell_text).astype(str).str.strip().str.lower() == sheet_cell_text(value).strip().lower()
+    return mask
+
+def pending_row_match(row):
+    """Pending/Corrected rows have no id column, so a row is identified by when, who and what."""
+    return {name: row[name] for name in ("Timestamp", "User_Email", "Prompt") if name in row.index}
+
+def apply_sheet_op(df, op):
+    """Returns df with one op applied. Columns are looked up before anything changes, so a bad op leaves df as it was."""
+    if op["kind"] == "append":
+        return pd.concat([df, pd.DataFrame(op["rows"])], ignore_index=True)
+
+    mask = sheet_row_mask(df, op["match"])
+    if not mask.any():
+        # Nothing to change means the write would be lost silently, so let it be dead-lettered
+        raise LookupError(f"no row matches {op['match']}")
+    if op["kind"] == "increment":
+        # Keep the whole column INT so the sheet never shows 5.0
+        col = sheet_column(df, op["column"])
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype(int)
+        df.loc[mask, col] += op["amount"]
+    elif op["kind"] == "update":
+        cols = {name: sheet_column(df, name) for name in op["values"]}
+        for name, value in op["values"].items():
+            df[cols[name]] = df[cols[name]].astype(object)
+            df.loc[mask, cols[name]] = value
+    elif op["kind"] == "delete":
+        hits = df.index[mask]
+        if op.get("limit"):
+            hits = hits[:op["limit"]]
+        df = df.drop(hits).reset_index(drop=True)
+    return df
+
+def apply_sheet_ops(df, ops):
+    """
+    Replays queued ops on a worksheet DataFrame. Used by the flush and to overlay reads.
+    Returns (df, applied ops, [(failed op, error)]); an op that fails is skipped, not fatal.
+    """
+    df = df.copy()
+    applied, failed = [], []
+    for op in ops:
+        try:
+            df = apply_sheet_op(df, op)
+            applied.append(op)
+        except Exception as e:
+            failed.append((op, f"{type(e).__name__}: {e}"))
+    return df, applied, failed
+
+def sheet_fingerprint(df):
+    """Hash of a worksheet's contents that survives the round trip through Sheets (3 == 3.0, NaN == '')."""
+    digest = hashlib.sha256("\x1f".join(str(c).strip() for c in df.columns).encode("utf-8"))
+    for row in df.astype(object).itertuples(index=False):
+        digest.update(("\x1e" + "\x1f".join(sheet_cell_text(v) for v in row)).encode("utf-8"))
+    return digest.hexdigest()
+
+def dead_letter_sheet_ops(writer, key, failed):
+    """Parks ops that can't be written. Call with writer['lock'] held."""
+    for op, error in failed:
+        writer["dead_letters"].append({"sheet": key, "op": op, "error": error, "at": time.time()})
+        bump_cache_counter("sheet_dead_letters")
+
+def queue_sheet_op(worksheet, op, spreadsheet=None):
+    """
+    Queues a write for the background flush. Increments and updates to the same row
+    are folded into the newest matching op, as long as no append/delete sits after it.
+    """
+    writer = get_sheet_writer()
+    with writer["lock"]:
+        ops = writer["pending"].setdefault((spreadsheet, worksheet), [])
+        if op["kind"] in ("increment", "update"):
+            for prev in reversed(ops):
+                if prev["kind"] in ("append", "delete"):
+                    break
+                if prev["kind"] != op["kind"] or prev["match"] != op["match"]:
+                    continue
+                if op["kind"] == "increment" and prev["column"] == op["column"]:
+                    prev["amount"] += op["amount"]
+                    return True
+                if op["kind"] == "update":
+                    # Swap in a new dict so a reader holding the old one never sees it change
+                    prev["values"] = {**prev["values"], **op["values"]}
+                    return True
+        ops.append(op)
+    writer["wake"].set()
+    return True
+
+def sheet_io_kwargs(spreadsheet, worksheet):
+    kwargs = {}
+    if spreadsheet:
+        kwargs["spreadsheet"] = spreadsheet
+    if worksheet:
+        kwargs["worksheet"] = worksheet
+    return kwargs
+
+def unwritten_sheet_ops(writer, key):
+    """Every op for a worksheet that may not be in the mirror yet, oldest first. Call with writer['lock'] held."""
+    retry = writer["retry"].get(key)
+    ops = (retry["ops"] if retry else []) + writer["inflight"].get(key, []) + writer["pending"].get(key, [])
+    return [dict(op) for op in ops]
+
+def read_sheet(worksheet=None, spreadsheet=None):
+    """
+    Reads a worksheet from the local mirror with any still-queued writes applied,
+    so a user sees their own changes. Only a sheet that was never mirrored hits the API.
+    """
+    key = (spreadsheet, worksheet)
+    mirror = get_sheet_mirror()
+    fetched = None
+    if not mirror_has(spreadsheet, worksheet):
+        fetched = sync_sheet(conn, spreadsheet, worksheet)
+
+    # Only the snapshot is taken under the lock. The mirror copy it pairs with is loaded
+    # after, and if a store slipped in between (versions differ) we simply take both again.
+    writer = get_sheet_writer()
+    for _ in range(5):
+        with writer["lock"]:
+            version = mirror["versions"].get(key)
+            ops = unwritten_sheet_ops(writer, key)
+        df, loaded_version = mirror_frame(spreadsheet, worksheet)
+        if loaded_version == version:
+            break
+    if df is None:
+        df = fetched
+    return apply_sheet_ops(df, ops)[0] if ops else df
+
+def take_due_sheet_batches(writer, force=False):
+    """
+    Moves every worksheet that is ready to write into 'inflight'. A worksheet with a failed
+    batch waits for its backoff, and its newer ops wait behind it so order is kept.
+    Returns {key: (retry entry or None, new ops)}.
+    """
+    now = time.time()
+    batches = {}
+    with writer["lock"]:
+        for key in set(writer["pending"]) | set(writer["retry"]):
+            retry = writer["retry"].get(key)
+            if retry and retry["next_at"] > now and not force:
+                continue
+            writer["retry"].pop(key, None)
+            new_ops = writer["pending"].pop(key, [])
+            batches[key] = (retry, new_ops)
+            writer["inflight"][key] = (retry["ops"] if retry else []) + new_ops
+    return batches
+
+def flush_sheet_batch(writer, sheets_conn, key, retry, new_ops):
+    spreadsheet, worksheet = key
+    kwargs = sheet_io_kwargs(spreadsheet, worksheet)
+    old_ops = retry["ops"] if retry else []
+    attempted = retry["attempted"] if retry else None
+    landed = retry["landed"] if retry else 0
+    ops = old_ops + new_ops
+    try:
+        df = sheets_conn.read(ttl=0, **kwargs)
+        # If the last update raised after it had already reached the sheet (e.g. a timeout),
+        # the sheet now matches what we tried to write: those ops are done, don't apply them twice
+        if attempted and sheet_fingerprint(df) == attempted:
+            ops = old_ops[landed:] + new_ops
+            bump_cache_counter("sheet_retries_already_written")
+        attempted, landed = None, 0
+
+        updated, ops, failed = apply_sheet_ops(df, ops)
+        if failed:
+            with writer["lock"]:
+                dead_letter_sheet_ops(writer, key, failed)
+        if ops:
+            attempted, landed = sheet_fingerprint(updated), len(ops)
+            sheets_conn.update(data=updated, **kwargs)
+    except Exception as e:
+        attempts = (retry["attempts"] if retry else 0) + 1
+        writer["last_error"] = f"{worksheet or 'Registry'}: {e}"
+        bump_cache_counter("sheet_flush_errors")
+        with writer["lock"]:
+            writer["inflight"].pop(key, None)
+            if attempts >= SHEET_MAX_RETRIES:
+                dead_letter_sheet_ops(writer, key, [(op, writer["last_error"]) for op in ops])
+            elif ops:
+                backoff = min(SHEET_RETRY_MAX_SECONDS, SHEET_RETRY_SECONDS * 2 ** (attempts - 1))
+                writer["retry"][key] = {
+                    "ops": ops, "attempts": attempts, "next_at": time.time() + backoff,
+                    "attempted": attempted, "landed": landed,
+                }
+        return
+
+    writer["last_error"] = None
+    bump_cache_counter("sheet_flushes")
+    bump_cache_counter("sheet_ops_written", len(ops))
+    # Write-through, so the mirror never lags behind our own writes
+    mirror = get_sheet_mirror()
+    with mirror["store_lock"]:
+        try:
+            version = mirror_store(spreadsheet, worksheet, updated)
+        except sqlite3.Error as e:
+            mirror["last_error"] = f"{worksheet or 'Registry'}: {e}"
+            version = None
+        # Publishing the new version and dropping the inflight ops together keeps
+        # readers from ever applying these ops on top of a copy that already has them
+        with writer["lock"]:
+            if version is not None:
+                mirror["versions"][key] = version
+            writer["inflight"].pop(key, None)
+
+def flush_sheet_writes(writer, sheets_conn, force=False):
+    """Writes every worksheet that is due. force=True ignores retry backoff (used at shutdown)."""
+    for key, (retry, new_ops) in take_due_sheet_batches(writer, force).items():
+        flush_sheet_batch(writer, sheets_conn, key, retry, new_ops)
+
+def sheet_writer_loop(writer, sheets_conn):
+    while True:
+        with writer["lock"]:
+            retry_times = [retry["next_at"] for retry in writer["retry"].values()]
+        timeout = max(0.0, min(retry_times) - time.time()) if retry_times else None
+        if writer["wake"].wait(timeout):
+            # Give bursts of clicks a moment to pile up so they go out as one batch
+            time.sleep(SHEET_FLUSH_SECONDS)
+        writer["wake"].clear()
+        flush_sheet_writes(writer, sheets_conn)
+        with writer["lock"]:
+            # New ops on a sheet that isn't backing off can go out straight away
+            if any(key not in writer["retry"] for key in writer["pending"]):
+                writer["wake"].set()
+
+def pending_sheet_writes():
+    writer = get_sheet_writer()
+    with writer["lock"]:
+        queued = sum(len(ops) for ops in writer["pending"].values())
+        queued += sum(len(retry["ops"]) for retry in writer["retry"].values())
+        return queued, writer["last_error"]
+
+def failed_sheet_writes():
+    writer = get_sheet_writer()
+    with writer["lock"]:
+        return list(writer["dead_letters"])
+
+def requeue_failed_sheet_writes():
+    """Puts every dead-lettered op back on the queue (e.g. after fixing a sheet's headers)."""
+    writer = get_sheet_writer()
+    with writer["lock"]:
+        letters = list(writer["dead_letters"])
+        writer["dead_letters"].clear()
+        for letter in letters:
+            writer["pending"].setdefault(letter["sheet"], []).append(letter["op"])
+    writer["wake"].set()
+    return len(letters)
+
+def discard_failed_sheet_writes():
+    writer = get_sheet_writer()
+    with writer["lock"]:
+        writer["dead_letters"].clear()
+
+# --- LOCAL SHEET MIRROR (SQLite) ---
+# Page loads read the Registry, Printers, Pending and Corrected sheets from a local
+# SQLite copy instead of the Sheets API. A background thread re-reads each mirrored
+# sheet every SHEET_SYNC_SECONDS; an unchanged sheet (same digest) costs no writes,
+# and a changed one is only rewritten from its first differing row, so appends stay cheap.
+SHEET_MIRROR_DB = os.environ.get("NAPKIN_SHEET_DB", os.path.join(".napkin_cache", "sheets.sqlite"))
+SHEET_SYNC_SECONDS = float(os.environ.get("NAPKIN_SHEET_SYNC_SECONDS", 30))
+
+def mirror_connect():
+    """Returns this thread's connection to the mirror DB (sqlite3 connections can't be shared between threads)."""
+    local = get_sheet_mirror()["local"]
+    if getattr(local, "db", None) is None:
+        local.db = sqlite3.connect(SHEET_MIRROR_DB, timeout=10)
+    return local.db
+
+@st.cache_resource
+def get_sheet_mirror():
+    os.makedirs(os.path.dirname(SHEET_MIRROR_DB) or ".", exist_ok=True)
+    with closing(sqlite3.connect(SHEET_MIRROR_DB, timeout=10)) as db, db:
+        # WAL is stored in the DB file, so setting it once covers every later connection
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sheets (name TEXT PRIMARY KEY, spreadsheet TEXT, worksheet TEXT, "
+            "columns TEXT, digest TEXT, row_count INTEGER, synced_at REAL, version INTEGER DEFAULT 0)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_rows (name TEXT, pos INTEGER, row_hash TEXT, data TEXT, "
+            "PRIMARY KEY (name, pos))"
+        )
+        # Mirrors created before sheets had a version column
+        if "version" not in [col[1] for col in db.execute("PRAGMA table_info(sheets)")]:
+            db.execute("ALTER TABLE sheets ADD COLUMN version INTEGER DEFAULT 0")
+        versions = {(s, w): v for s, w, v in db.execute("SELECT spreadsheet, worksheet, version FROM sheets")}
+
+    mirror = {
+        "local": threading.local(),
+        "store_lock": threading.Lock(),   # Serializes stores, so a stale sync can't land after a flush
+        "versions": versions,   # (spreadsheet, worksheet) -> version readers should see; bumped on every store
+        "frames": {},           # (spreadsheet, worksheet) -> (version, DataFrame) last decoded from the DB
+        "last_sync": None,
+        "last_error": None,
+        "rows_written": 0,
+        "syncs": 0,
+    }
+    thread = threading.Thread(target=sheet_sync_loop, args=(mirror, conn), name="napkin-sheet-sync", daemon=True)
+    thread.start()
+    return mirror
+
+def mirror_name(spreadsheet, worksheet):
+    return f"{spreadsheet or ''}|{worksheet or ''}"
+
+def mirror_has(spreadsheet, worksheet):
+    return (spreadsheet, worksheet) in get_sheet_mirror()["versions"]
+
+def mirror_load(spreadsheet, worksheet):
+    """
+    Returns (DataFrame, version) for the mirrored worksheet, or (None, None) if it was never synced.
+    Both come from one read transaction, so the version always matches the rows.
+    """
+    name = mirror_name(spreadsheet, worksheet)
+    db = mirror_connect()
+    db.execute("BEGIN")
+    try:
+        meta = db.execute("SELECT columns, version FROM sheets WHERE name = ?", (name,)).fetchone()
+        if meta is None:
+            return None, None
+        rows = db.execute("SELECT data FROM sheet_rows WHERE name = ? ORDER BY pos", (name,)).fetchall()
+    finally:
+        db.commit()
+    return pd.DataFrame([json.loads(data) for (data,) in rows], columns=json.loads(meta[0])), meta[1]
+
+def mirror_frame(spreadsheet, worksheet):
+    """mirror_load(), but a version that was already decoded is handed out as a copy instead of read again."""
+    key = (spreadsheet, worksheet)
+    mirror = get_sheet_mirror()
+    cached = mirror["frames"].get(key)
+    if cached and cached[0] == mirror["versions"].get(key):
+        bump_cache_counter("sheet_frame_hits")
+        return cached[1].copy(), cached[0]
+
+    df, version = mirror_load(spreadsheet, worksheet)
+    if df is not None:
+        mirror["frames"][key] = (version, df)
+    return (df.copy() if df is not None else None), version
+
+def mirror_store(spreadsheet, worksheet, df):
+    """
+    Saves a fresh copy of a worksheet and returns its new version, or None when nothing changed.
+    Rows are hashed so only the tail from the first changed row is rewritten.
+    Call with mirror['store_lock'] held; the caller publishes the version to mirror['versions'].
+    """
+    name = mirror_name(spreadsheet, worksheet)
+    columns = json.dumps([str(c) for c in df.columns])
+    clean = df.astype(object).where(df.notna(), None)
+    rows = [json.dumps(values, default=str) for values in clean.values.tolist()]
+    hashes = [hashlib.sha1(row.encode("utf-8")).hexdigest() for row in rows]
+    digest = hashlib.sha256(f"{columns}\n{''.join(hashes)}".encode("utf-8")).hexdigest()
+
+    mirror = get_sheet_mirror()
+    db = mirror_connect()
+    with db:
+        meta = db.execute("SELECT digest, columns, version FROM sheets WHERE name = ?", (name,)).fetchone()
+        if meta and meta[0] == digest:
+            db.execute("UPDATE sheets SET synced_at = ? WHERE name = ?", (time.time(), name))
+            return None
+
+        # 1. Keep the unchanged head (same columns, same row hashes in the same order)
+        start = 0
+        if meta and meta[1] == columns:
+            old_hashes = [h for (h,) in db.execute("SELECT row_hash FROM sheet_rows WHERE name = ? ORDER BY pos", (name,))]
+            limit = min(len(old_hashes), len(hashes))
+            while start < limit and old_hashes[start] == hashes[start]:
+                start += 1
+
+        # 2. Replace everything after it
+        version = (meta[2] or 0) + 1 if meta else 1
+        db.execute("DELETE FROM sheet_rows WHERE name = ? AND pos >= ?", (name, start))
+        db.executemany(
+            "INSERT INTO sheet_rows (name, pos, row_hash, data) VALUES (?, ?, ?, ?)",
+            [(name, i, hashes[i], rows[i]) for i in range(start, len(rows))]
+        )
+        db.execute(
+            "INSERT OR REPLACE INTO sheets (name, spreadsheet, worksheet, columns, digest, row_count, synced_at, version) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, spreadsheet, worksheet, columns, digest, len(rows), time.time(), version)
+        )
 
-@st.cache_data(ttl=10)
-def load_registry():
-    # 1. Pull the URL from the specific secrets path
-    url = st.secrets["connections"]["gsheets"]["registry"]
-    
-    # 2. Connect and read the data
-    df = conn.read(spreadsheet=url)
+    mirror["rows_written"] += len(rows) - start
+    return version
+
+def sync_sheet(sheets_conn, spreadsheet, worksheet):
+    """Pulls one worksheet from the Sheets API into the mirror and returns it."""
+    key = (spreadsheet, worksheet)
+    mirror = get_sheet_mirror()
+    version = mirror["versions"].get(key)
+    df = sheets_conn.read(ttl=0, **sheet_io_kwargs(spreadsheet, worksheet))
+
+    writer = get_sheet_writer()
+    with mirror["store_lock"]:
+        with writer["lock"]:
+            # A flush that landed (or is landing) while we were reading is newer than what we fetched
+            if mirror["versions"].get(key) != version or key in writer["inflight"]:
+                return df
+        stored = mirror_store(spreadsheet, worksheet, df)
+        if stored is not None:
+            with writer["lock"]:
+                mirror["versions"][key] = stored
+    return df
+
+def sync_all_sheets(mirror, sheets_conn):
+    sources = list(mirror["versions"])
+
+    mirror["last_error"] = None
+    for spreadsheet, worksheet in sources:
+        try:
+            sync_sheet(sheets_conn, spreadsheet, worksheet)
+        except Exception as e:
+            mirror["last_error"] = f"{worksheet or 'Registry'}: {e}"
+    mirror["syncs"] += 1
+    mirror["last_sync"] = time.time()
+
+def sheet_sync_loop(mirror, sheets_conn):
+    # The first pass runs straight away, so a restart serves the on-disk copy only briefly
+    while True:
+        sync_all_sheets(mirror, sheets_conn)
+        time.sleep(SHEET_SYNC_SECONDS)
+
+
+def load_registry(url):
+    """Reads the Registry sheet at url (resolved from secrets by get_registry() on the script thread)."""
+    # 1. Connect and read the data (including any counter bumps still queued)
+    df = read_sheet(spreadsheet=url)
     
-    # 3. Standardize column names (lowercase and no spaces)
+    # 2. Standardize column names (lowercase and no spaces)
     df.columns = [c.strip().lower() for c in df.columns]
     
-    # 4. Cleanup the Email column
+    # 3. Cleanup the Email column
     # Drop rows where email is missing
     df = df.dropna(subset=['email'])
     # Force to string, strip whitespace, and lowercase for perfect matching
     df['email'] = df['email'].astype(str).str.strip().str.lower()
     
-    # 5. Clean up numeric columns (Parts and Printers)
+    # 4. Clean up numeric columns (Parts and Printers)
     # pd.to_numeric with 'coerce' turns errors into NaN, then fillna(0) makes them 0
     # .astype(int) ensures 0 decimal places (e.g., 5.0 becomes 5)
     df['geedback given'] = pd.to_numeric(df['feedback given'], errors='coerce').fillna(0).astype(int)
@@ -49,26 +535,82 @@ def load_registry():
     # Inside your load_registry function
     df['feedback given'] = pd.to_numeric(df['feedback given'], errors='coerce').fillna(0).astype(int)
 
-    # 6. Convert to the dictionary format your Profile page expects
+    # 5. Convert to the dictionary format your Profile page expects (email -> row, so lookups are O(1))
     return df.set_index('email').to_dict('index')
 
 
+# --- REGISTRY CACHE ---
+# Every rerun (and the cookie auto-login) looks users up in one process-wide dict.
+# Once it is older than REGISTRY_TTL the stale copy keeps being served while a
+# background thread rebuilds it, so a slow Sheets read never holds up a page.
+REGISTRY_TTL = float(os.environ.get("NAPKIN_REGISTRY_TTL", 10))
+
+@st.cache_resource
+def get_registry_cache():
+    return {"lock": threading.Lock(), "users": None, "loaded_at": 0.0, "refreshing": False, "last_error": None}
+
+def refresh_registry(cache, url):
+    try:
+        users = load_registry(url)
+    except Exception as e:
+        with cache["lock"]:
+            cache["refreshing"] = False
+            cache["last_error"] = str(e)
+        return
+
+    with cache["lock"]:
+        cache["users"] = users
+        cache["loaded_at"] = time.time()
+        cache["refreshing"] = False
+        cache["last_error"] = None
+
+def start_registry_refresh(cache, url):
+    """Kicks off one background rebuild unless one is already running."""
+    with cache["lock"]:
+        if cache["refreshing"]:
+            return
+        cache["refreshing"] = True
+    threading.Thread(target=refresh_registry, args=(cache, url), name="napkin-registry", daemon=True).start()
+
+def get_registry():
+    """email -> user row. Only the first call on a fresh server waits for the sheet."""
+    url = st.secrets["connections"]["gsheets"]["registry"]
+    cache = get_registry_cache()
+    with cache["lock"]:
+        users = cache["users"]
+        stale = time.time() - cache["loaded_at"] > REGISTRY_TTL
+
+    if users is None:
+        refresh_registry(cache, url)
+        with cache["lock"]:
+            if cache["users"] is None:
+                raise RuntimeError(cache["last_error"])
+            return cache["users"]
+
+    if stale:
+        start_registry_refresh(cache, url)
+    return users
+
+def invalidate_registry():
+    """Called by the registry write paths so the next page sees the change without waiting out the TTL."""
+    cache = get_registry_cache()
+    with cache["lock"]:
+        cache["loaded_at"] = 0.0
+    start_registry_refresh(cache, st.secrets["connections"]["gsheets"]["registry"])
+
+
 def update_printer_count(email_to_update):
     try:
         url = st.secrets["connections"]["gsheets"]["registry"]
-        df = conn.read(spreadsheet=url, ttl=0)
-        df.columns = [c.strip().lower() for c in df.columns]
-        
-        mask = df['email'].str.strip().str.lower() == email_to_update.lower().strip()
-        
-        if mask.any():
-            # Get current count, handle errors/empty, add 1
-            current_val = pd.to_numeric(df.loc[mask, 'printers'], errors='coerce').fillna(0).astype(int)
-            df.loc[mask, 'printers'] = int(current_val + 1)
-            
-            # Save back to sheet
-            conn.update(spreadsheet=url, data=df)
-            return True
+        # Queued as a +1, so two users adding printers at once can't overwrite each other
+        queue_sheet_op(None, {
+            "kind": "increment",
+            "match": {"email": email_to_update.lower().strip()},
+            "column": "printers",
+            "amount": 1,
+        }, spreadsheet=url)
+        invalidate_registry()
+        return True
     except Exception as e:
         st.error(f"Error updating printer count: {e}")
     return False
@@ -76,31 +618,21 @@ def update_printer_count(email_to_update):
 
 def update_printer_in_sheet(nickname, material, infill, supports, nozzle, bed, walls):
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        REGISTRY_DOC_URL = "https://docs.google.com/spreadsheets/d/YOUR_REGISTRY_ID_HERE/edit"
-        
-        # 1. Read the current data
-        df = conn.read(spreadsheet=REGISTRY_DOC_URL, worksheet="Printers", ttl=0)
-        
-        # 2. Find the row index where company and nickname match
-        # We use companyname to ensure Enterprise users don't accidentally edit a different company's printer with the same nickname
-        mask = (df['companyname'] == st.session_state.user_company) & (df['printer nickname'] == nickname)
-        
-        if not df[mask].empty:
-            # 3. Update the values in that row
-            df.loc[mask, 'material'] = material
-            df.loc[mask, 'infil'] = f"{infill}%"
-            df.loc[mask, 'supports'] = supports
-            df.loc[mask, 'nozzle size'] = nozzle
-            df.loc[mask, 'bed type'] = bed
-            df.loc[mask, 'wall count'] = walls
-            
-            # 4. Write the whole dataframe back to the sheet
-            conn.update(spreadsheet=REGISTRY_DOC_URL, worksheet="Printers", data=df)
-            return True
-        else:
-            st.error("Printer not found in database.")
-            return False
+        # We match on company too so Enterprise users don't accidentally edit a different company's printer with the same nickname
+        queue_sheet_op("Printers", {
+            "kind": "update",
+            "match": {"company": st.session_state.user_company, "printer nickname": nickname},
+            "values": {
+                "material": material,
+                "infil": f"{infill}%",
+                "supports": supports,
+                "nozzle size": nozzle,
+                "bed type": bed,
+                "wall count": walls,
+            },
+        }, spreadsheet=REGISTRY_DOC_URL)
+        invalidate_fleet()
+        return True
     except Exception as e:
         st.error(f"Update failed: {e}")
         return False
@@ -108,31 +640,21 @@ def update_printer_in_sheet(nickname, material, infill, supports, nozzle, bed, w
 def increment_models_generated(email_to_update):
     try:
         url = st.secrets["connections"]["gsheets"]["registry"]
-        df = conn.read(spreadsheet=url, ttl=0)
-        df.columns = [c.strip().lower() for c in df.columns]
-        
-        mask = df['email'].str.strip().str.lower() == email_to_update.lower().strip()
-        
-        if mask.any():
-            # 1. Force current value to int
-            current_val = pd.to_numeric(df.loc[mask, 'feedback given'], errors='coerce').fillna(0).astype(int)
-            
-            # 2. Perform the math
-            df.loc[mask, 'feedback given'] = int(current_val + 1)
-            
-            # 3. Final safety check: ensure the whole column is INT before updating
-            df['feedback given'] = df['feedback given'].astype(int)
-            
-            conn.update(spreadsheet=url, data=df)
-            st.cache_data.clear()
-            return True
+        queue_sheet_op(None, {
+            "kind": "increment",
+            "match": {"email": email_to_update.lower().strip()},
+            "column": "feedback given",
+            "amount": 1,
+        }, spreadsheet=url)
+        invalidate_registry()
+        return True
     except Exception as e:
         st.error(f"Internal Increment Error: {e}")
     return False
 
 # Initialize
 try:
-    BETA_USERS = load_registry()
+    BETA_USERS = get_registry()
 except Exception as e:
     st.error(f"Registry Connection Failed: {e}")
     BETA_USERS = {}
@@ -189,7 +711,7 @@ conn = st.connection("gsheets", type=GSheetsConnection)
 # --- FUNCTIONS ---
 def sync_scad_from_sheets():
     try:
-        corrected_df = conn.read(worksheet="Corrected", ttl=0)
+        corrected_df = read_sheet("Corrected")
         if not corrected_df.empty:
             with open("ai_training.scad", "w") as f:
                 for _, row in corrected_df.iterrows():
@@ -210,10 +732,8 @@ if not st.session_state.initial_sync_done:
         
 def add_to_printers_sheet(brand, model, nickname, material, infill, supports, nozzle, bed, walls):
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        
-        # 1. Create the new row DataFrame with your exact column names
-        new_row = pd.DataFrame([{
+        # 1. Create the new row with your exact column names
+        new_row = {
             "company": st.session_state.user_company,
             "name": st.session_state.user_name,
             "email": st.session_state.user_email,
@@ -226,18 +746,11 @@ def add_to_printers_sheet(brand, model, nickname, material, infill, supports, no
             "nozzle size": nozzle,
             "bed type": bed,
             "wall count": walls
-        }])
-        
-        # 2. Read from the Registry Doc, Printers tab
-        # IMPORTANT: Replace YOUR_REGISTRY_URL with your actual URL
-        REGISTRY_DOC_URL = "https://docs.google.com/spreadsheets/d/1ah2kXgEWyKqJktl9sapasqXQdShdgw0yB5qDR-9qX3A/edit"
-        
-        existing_data = conn.read(spreadsheet=REGISTRY_DOC_URL, worksheet="Printers", ttl=0)
-        
-        # 3. Append and update
-        updated_df = pd.concat([existing_data, new_row], ignore_index=True)
-        conn.update(spreadsheet=REGISTRY_DOC_URL, worksheet="Printers", data=updated_df)
+        }
         
+        # 2. Append it to the Registry Doc, Printers tab on the next flush
+        queue_sheet_op("Printers", {"kind": "append", "rows": [new_row]}, spreadsheet=REGISTRY_DOC_URL)
+        invalidate_fleet()
         return True
     except Exception as e:
         st.error(f"Error: {e}")
@@ -245,60 +758,264 @@ def add_to_printers_sheet(brand, model, nickname, material, infill, supports, no
 
 def delete_printer_from_sheet(nickname):
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        REGISTRY_DOC_URL = "https://docs.google.com/spreadsheets/d/1ah2kXgEWyKqJktl9sapasqXQdShdgw0yB5qDR-9qX3A/edit"
-        
-        df = conn.read(spreadsheet=REGISTRY_DOC_URL, worksheet="Printers", ttl=0)
-        df.columns = [c.strip().lower() for c in df.columns]
-        
-        original_count = len(df)
-        # Filtering using 'company' to match your save function
-        df = df[~((df['company'] == st.session_state.user_company) & (df['printer nickname'] == nickname))]
-        
-        if len(df) < original_count:
-            conn.update(spreadsheet=REGISTRY_DOC_URL, worksheet="Printers", data=df)
-            return True
-        return False
+        # Matching on 'company' to match your save function
+        queue_sheet_op("Printers", {
+            "kind": "delete",
+            "match": {"company": st.session_state.user_company, "printer nickname": nickname},
+        }, spreadsheet=REGISTRY_DOC_URL)
+        invalidate_fleet()
+        return True
     except Exception as e:
         st.error(f"Deletion failed: {e}")
         return False
 
+# --- FLEET CACHE ---
+# The Printers sheet is split once into per-company and per-email fleets, so
+# get_my_fleet() is a dict lookup. The split is only redone when the mirrored sheet
+# changes (sync or flush) or a printer write path calls invalidate_fleet().
+@st.cache_resource
+def get_fleet_cache():
+    return {
+        "lock": threading.Lock(),
+        "by_company": {},
+        "by_email": {},
+        "version": None,      # Printers mirror version the partitions were built from
+        "generation": 0,      # Bumped by invalidate_fleet() to discard an in-progress load
+    }
+
+def printers_mirror_version():
+    return get_sheet_mirror()["versions"].get((REGISTRY_DOC_URL, "Printers"), 0)
+
+def load_fleet_partitions(cache):
+    with cache["lock"]:
+        generation = cache["generation"]
+    version = printers_mirror_version()
+    df = read_sheet("Printers", spreadsheet=REGISTRY_DOC_URL)
+
+    by_company, by_email = {}, {}
+    if not df.empty:
+        # Standardize column names: strip spaces and lowercase everything
+        df.columns = [c.strip().lower() for c in df.columns]
+        # Use 'company' (lowercase) because that's what add_to_printers_sheet uses
+        by_company = {key: group for key, group in df.groupby(df['company'].astype(str).str.strip(), sort=False)}
+        by_email = {key: group for key, group in df.groupby(df['email'].astype(str).str.strip().str.lower(), sort=False)}
+
+    with cache["lock"]:
+        # A write that landed while we were reading means this copy is already out of date
+        if cache["generation"] == generation:
+            cache["by_company"] = by_company
+            cache["by_email"] = by_email
+            cache["version"] = version
+    return by_company, by_email
+
+def invalidate_fleet():
+    cache = get_fleet_cache()
+    with cache["lock"]:
+        cache["version"] = None
+        cache["generation"] += 1
+
 def get_my_fleet():
     if not st.session_state.get('authenticated', False):
         return pd.DataFrame()
 
     try:
-        conn = st.connection("gsheets", type=GSheetsConnection)
-        # Verify this URL matches your actual Printer tab location
-        REGISTRY_DOC_URL = "https://docs.google.com/spreadsheets/d/1ah2kXgEWyKqJktl9sapasqXQdShdgw0yB5qDR-9qX3A/edit"
-        df = conn.read(spreadsheet=REGISTRY_DOC_URL, worksheet="Printers", ttl=0)
-
-        if df.empty:
-            return pd.DataFrame()
-
-        # Standardize column names: strip spaces and lowercase everything
-        df.columns = [c.strip().lower() for c in df.columns]
+        cache = get_fleet_cache()
+        with cache["lock"]:
+            by_company, by_email = cache["by_company"], cache["by_email"]
+            fresh = cache["version"] is not None and cache["version"] == printers_mirror_version()
+        if not fresh:
+            by_company, by_email = load_fleet_partitions(cache)
 
         user_tier = st.session_state.get('user_tier', 'Starter')
         user_email = str(st.session_state.get('user_email', '')).lower().strip()
         user_company = str(st.session_state.get('user_company', '')).strip()
 
-        # Use 'company' (lowercase) because that's what add_to_printers_sheet uses
         if user_tier == "Enterprise":
-            return df[df['company'] == user_company]
+            fleet = by_company.get(user_company)
         else:
-            return df[df['email'] == user_email]
+            fleet = by_email.get(user_email)
+        # Hand out a copy so a caller can't edit the shared partition
+        return fleet.copy() if fleet is not None else pd.DataFrame()
             
     except Exception as e:
         st.error(f"Fleet Fetch Error: {e}")
         return pd.DataFrame()
 
+# --- RECIPE CATALOG ---
+# Every recipes/*.ini parsed once into memory and indexed by brand -> model -> material -> nozzle.
+# Filenames follow "<Brand> <Model> <Material> <Nozzle>mm". The catalog is rebuilt when the
+# folder's mtime changes (a recipe added, removed or replaced), so a rerun costs one stat().
+RECIPE_DIR = "./recipes"
+RECIPE_KEY_ALIASES = {
+    # Orca/Bambu exports use different names for the same machine limits
+    "printable_area": "bed_shape",
+    "printable_height": "max_print_height",
+}
+
+def parse_recipe_file(path):
+    """Reads a slicer .ini into a {key: raw string value} dict."""
+    settings = {}
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            key, sep, value = line.partition("=")
+            if sep:
+                settings[key.strip()] = value.strip()
+    return settings
+
+def first_recipe_value(value, cast=str):
+    """First entry of a per-extruder value such as '0.4,0.4' or 'PLA;PLA'; None if it doesn't parse."""
+    try:
+        return cast(re.split(r"[,;]", str(value))[0].strip().strip('"'))
+    except ValueError:
+        return None
+
+def parse_bed_shape(value):
+    """(width, depth) of a bed_shape polygon such as '0x0,250x0,250x210,0x210'."""
+    points = []
+    for point in str(value).split(","):
+        x, sep, y = point.partition("x")
+        try:
+            points.append((float(x), float(y)))
+        except ValueError:
+            continue
+    if not points:
+        return None
+    if len(points) == 1:
+        return points[0]  # Some Orca exports only give the far corner
+    xs, ys = [p[0] for p in points], [p[1] for p in points]
+    return (max(xs) - min(xs), max(ys) - min(ys))
+
+def parse_recipe_name(name):
+    """(brand, model, material, nozzle) from '<Brand> <Model> <Material> <Nozzle>mm', or None."""
+    parts = name.split(" ")
+    if len(parts) < 4 or not parts[-1].endswith("mm"):
+        return None
+    nozzle = first_recipe_value(parts[-1][:-2], float)
+    if nozzle is None:
+        return None
+    return parts[0], " ".join(parts[1:-2]), parts[-2], nozzle
+
+def build_recipe_entry(filename):
+    name = filename[:-len(".ini")]
+    path = os.path.join(RECIPE_DIR, filename)
+    settings = parse_recipe_file(path)
+    for alias, key in RECIPE_KEY_ALIASES.items():
+        if alias in settings and key not in settings:
+            settings[key] = settings[alias]
+
+    entry = {
+        "name": name,
+        "path": path,
+        "brand": None, "model": None, "material": None, "nozzle": None,
+        "bed_size": parse_bed_shape(settings.get("bed_shape", "")),
+        "max_print_height": first_recipe_value(settings.get("max_print_height", ""), float),
+        "nozzle_diameter": first_recipe_value(settings.get("nozzle_diameter", ""), float),
+        "filament_type": first_recipe_value(settings.get("filament_type", "")),
+        "settings": settings,
+    }
+    parsed_name = parse_recipe_name(name)
+    if parsed_name:
+        entry["brand"], entry["model"], entry["material"], entry["nozzle"] = parsed_name
+    return entry
+
+@st.cache_resource
+def get_recipe_store():
+    return {"lock": threading.Lock(), "stamp": None, "recipes": {}, "index": {}}
+
+def get_recipe_catalog():
+    """
+    The parsed recipe catalog, rebuilt only when a recipe file changes. Keyed on every file's
+    (name, mtime, size), since overwriting a file in place doesn't touch the folder's mtime.
+    """
+    store = get_recipe_store()
+    stamp = tuple(sig for sig in get_library_signature(RECIPE_DIR) if sig[0].endswith(".ini"))
+
+    with store["lock"]:
+        if stamp == store["stamp"]:
+            return store
+
+        recipes, index = {}, {}
+        for filename, _, _ in stamp:
+            try:
+                entry = build_recipe_entry(filename)
+            except OSError:
+                continue
+            recipes[entry["name"]] = entry
+            if entry["brand"]:
+                (index.setdefault(entry["brand"], {})
+                      .setdefault(entry["model"], {})
+                      .setdefault(entry["material"], {}))[entry["nozzle"]] = entry["name"]
+
+        store.update({"stamp": stamp, "recipes": recipes, "index": index})
+    return store
+
+def get_recipe(name):
+    """Catalog entry for a recipe name (filename without .ini), or None."""
+    return get_recipe_catalog()["recipes"].get(name)
+
+def find_recipe(brand, model, material, nozzle):
+    try:
+        nozzle = float(nozzle)
+    except (TypeError, ValueError):
+        return None
+    name = get_recipe_catalog()["index"].get(brand, {}).get(model, {}).get(material, {}).get(nozzle)
+    return get_recipe(name) if name else None
+
+def recipe_brands():
+    return sorted(get_recipe_catalog()["index"])
+
+def recipe_models(brand):
+    return sorted(get_recipe_catalog()["index"].get(brand, {}))
+
+def recipe_materials(brand, model):
+    return sorted(get_recipe_catalog()["index"].get(brand, {}).get(model, {}))
+
+def recipe_nozzles(brand, model):
+    nozzles = set()
+    for by_nozzle in get_recipe_catalog()["index"].get(brand, {}).get(model, {}).values():
+        nozzles.update(by_nozzle)
+    return sorted(nozzles)
+
 def get_verified_recipes():
     """Returns a list of all .ini filenames in the recipes folder without the extension."""
-    recipe_path = "./recipes"
-    if not os.path.exists(recipe_path):
-        return []
-    return [f.replace(".ini", "") for f in os.listdir(recipe_path) if f.endswith(".ini")]
+    return list(get_recipe_catalog()["recipes"])
+
+def stl_bounding_box(stl_path):
+    """(x, y, z) extents of an ASCII or binary STL, or None if it can't be read."""
+    with open(stl_path, "rb") as f:
+        data = f.read()
+    if len(data) >= 84:
+        count = int(np.frombuffer(data, dtype="<u4", count=1, offset=80)[0])
+        if len(data) == 84 + 50 * count and count:
+            facets = np.frombuffer(data, dtype=np.dtype([("normal", "<f4", 3), ("v", "<f4", (3, 3)), ("attr", "<u2")]), count=count, offset=84)
+            vertices = facets["v"].reshape(-1, 3)
+            return tuple(float(v) for v in vertices.max(axis=0) - vertices.min(axis=0))
+    rows = re.findall(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)", data)
+    if not rows:
+        return None
+    vertices = np.array(rows).astype(np.float64)
+    return tuple(float(v) for v in vertices.max(axis=0) - vertices.min(axis=0))
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def get_part_size(stl_path, mtime_ns):
+    """Cached stl_bounding_box; mtime_ns is only part of the cache key."""
+    return stl_bounding_box(stl_path)
+
+def part_fits_recipe(part_size, recipe):
+    """
+    Checks a part's (x, y, z) size against a recipe's bed and height, allowing a 90 degree turn.
+    Returns (fits, reason); unknown machine limits count as a fit.
+    """
+    x, y, z = part_size
+    if recipe["bed_size"]:
+        bed_x, bed_y = recipe["bed_size"]
+        if not ((x <= bed_x and y <= bed_y) or (y <= bed_x and x <= bed_y)):
+            return False, f"{x:.0f} x {y:.0f} mm footprint exceeds the {bed_x:.0f} x {bed_y:.0f} mm bed"
+    if recipe["max_print_height"] and z > recipe["max_print_height"]:
+        return False, f"{z:.0f} mm height exceeds the {recipe['max_print_height']:.0f} mm build height"
+    return True, ""
 
 def clean_infill(infill_value):
     """Converts '15%' or 15 to a clean integer 15."""
@@ -322,17 +1039,71 @@ PRINTER_MASTER_LIST = {
 }
 
 
-def apply_bambu_overrides(gcode_path, brand, model):
+# --- G-CODE POST-PROCESSING ---
+# Brand/model specific passes over the sliced G-code. Each pass is a dict with optional
+# "header"/"footer" line lists and a "transform" that maps one line to a new line (or None
+# to drop it). All matching passes are applied together in a single streaming read.
+GCODE_PROCESSORS = []
+GCODE_COPY_CHUNK = 1024 * 1024
+
+def register_gcode_processor(name, brand_keyword, build, model_keyword=None):
+    """Registers build(brand, model) -> pass dict for printers whose brand (and model) match."""
+    GCODE_PROCESSORS.append({
+        "name": name,
+        "brand": brand_keyword.lower(),
+        "model": model_keyword.upper() if model_keyword else None,
+        "build": build,
+    })
+
+def matching_gcode_processors(brand, model):
+    return [
+        p for p in GCODE_PROCESSORS
+        if p["brand"] in str(brand).lower() and (p["model"] is None or p["model"] in str(model).upper())
+    ]
+
+def run_gcode_pipeline(gcode_path, passes):
     """
-    Surgically injects Bambu machine logic into the G-code file.
-    Uses a 150C no-ooze temp for safe, universal homing.
+    Streams gcode_path through the passes into a temp file and swaps it in.
+    Memory stays constant regardless of G-code size.
     """
-    if "bambu" not in brand.lower():
-        return 
+    headers = [line for p in passes for line in p.get("header", [])]
+    footers = [line for p in passes for line in p.get("footer", [])]
+    transforms = [p["transform"] for p in passes if p.get("transform")]
 
-    with open(gcode_path, 'r') as f:
-        lines = f.readlines()
+    tmp_path = f"{gcode_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(gcode_path, "r", newline="") as src, open(tmp_path, "w", newline="") as dst:
+            dst.writelines(headers)
+            if transforms:
+                for line in src:
+                    for transform in transforms:
+                        line = transform(line)
+                        if line is None:
+                            break
+                    else:
+                        dst.write(line)
+            else:
+                # No per-line work, so copy in big chunks
+                shutil.copyfileobj(src, dst, GCODE_COPY_CHUNK)
+            dst.writelines(footers)
+        os.replace(tmp_path, gcode_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def post_process_gcode(gcode_path, brand, model):
+    """Applies every registered pass for this brand/model. Returns the names of the passes applied."""
+    processors = matching_gcode_processors(brand, model)
+    if not processors:
+        return []
+    run_gcode_pipeline(gcode_path, [p["build"](brand, model) for p in processors])
+    return [p["name"] for p in processors]
 
+def bambu_gcode_pass(brand, model):
+    """
+    Surgically injects Bambu machine logic into the G-code file.
+    Uses a 150C no-ooze temp for safe, universal homing.
+    """
     is_a1 = "A1" in model.upper()
     cut_move = "G1 X-10 F3000\n" if is_a1 else "G1 X1 Y10 F12000\nG1 X1 Y-0.5 F3000\nG1 Y10 F3000\n"
 
@@ -360,101 +1131,1940 @@ def apply_bambu_overrides(gcode_path, brand, model):
         "M84\n"              # Motors off
     ]
 
-    with open(gcode_path, 'w') as f:
-        f.writelines(header + lines + footer)
+    return {"header": header, "footer": footer}
+
+register_gcode_processor("bambu", "bambu", bambu_gcode_pass)
+
+
+# --- SLICING ---
+def duration_seconds(duration_str):
+    """Converts a slicer duration string such as '1d 2h 20m 5s' to seconds."""
+    d_match = re.search(r'(\d+)d', duration_str)
+    h_match = re.search(r'(\d+)h', duration_str)
+    m_match = re.search(r'(\d+)m', duration_str)
+    s_match = re.search(r'(\d+)s', duration_str)
+    
+    days = int(d_match.group(1)) if d_match else 0
+    hours = int(h_match.group(1)) if h_match else 0
+    minutes = int(m_match.group(1)) if m_match else 0
+    seconds = int(s_match.group(1)) if s_match else 0
+    return int(timedelta(days=days, hours=hours, minutes=minutes, seconds=seconds).total_seconds())
+
+def estimate_finish_time(duration_str):
+    """Wall-clock finish time for a slicer duration string such as '1h 20m 5s'."""
+    try:
+        finish_dt = datetime.now() + timedelta(seconds=duration_seconds(duration_str))
+        return finish_dt.strftime("%I:%M %p")
+    except:
+        return "Calc Error"
+
+def printer_slice_settings(p_settings):
+    """Recipe name and fleet overrides for one row of the Printers sheet."""
+    # Ensure we match the file naming convention exactly
+    hardware_name = f"{p_settings['brand']} {p_settings['model']} {p_settings['material']} {p_settings['nozzle size']}mm"
+    
+    overrides = {
+        "infill": str(p_settings['infil']).replace('%', ''),
+        "walls": int(p_settings.get('wall count', 3)),
+        "supports": p_settings['supports']
+    }
+    return hardware_name, overrides
+
+
+# PrusaSlicer writes its stats and the full config into the last few hundred lines of the
+# G-code, so only a bounded tail is read. Keys are matched case-insensitively.
+GCODE_FOOTER_BYTES = 256 * 1024
+GCODE_FOOTER_FIELDS = {
+    "filament used [mm]": ("filament_mm", float),
+    "filament used [cm3]": ("filament_cm3", float),
+    "filament used [g]": ("filament_g", float),
+    "total filament used [g]": ("filament_g", float),
+    "filament cost": ("filament_cost", float),
+    "total filament cost": ("filament_cost", float),
+    "total layers count": ("layer_count", int),
+    "total layer number": ("layer_count", int),
+    "max_layer_z": ("max_layer_z", float),
+}
+GCODE_TIME_RE = re.compile(r"estimated (first layer )?printing time \((.+?) mode\)", re.IGNORECASE)
+
+def parse_footer_number(value, cast):
+    """Sums per-extruder lists such as '12.3, 4.5'; returns None if nothing parses."""
+    total, found = 0, False
+    for part in value.split(","):
+        try:
+            total += cast(float(part.strip()))
+            found = True
+        except ValueError:
+            pass
+    return total if found else None
 
+def parse_gcode_metadata(gcode_path):
+    """
+    Reads the slicer footer once and returns a stats dict:
+    time/time_seconds (normal mode), times and first_layer_times per mode, filament_mm/cm3/g,
+    filament_cost, layer_count, max_layer_z and the embedded config as a dict of strings.
+    """
+    stats = {
+        "time": "Unknown", "time_seconds": None, "finish_time": "Unknown",
+        "times": {}, "first_layer_times": {},
+        "filament_mm": None, "filament_cm3": None, "filament_g": None, "filament_cost": None,
+        "layer_count": None, "max_layer_z": None,
+        "config": {},
+    }
+
+    with open(gcode_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - GCODE_FOOTER_BYTES))
+        tail = f.read().decode("utf-8", errors="replace")
+    lines = tail.splitlines()
+    if size > GCODE_FOOTER_BYTES:
+        lines = lines[1:]  # First line is probably cut in half
+
+    in_config = False
+    for line in lines:
+        if not line.startswith(";"):
+            continue
+        key, sep, value = line[1:].partition("=")
+        if not sep:
+            continue
+        key, value = key.strip(), value.strip()
+        lower_key = key.lower()
+
+        if lower_key.endswith("_config") and value in ("begin", "end"):
+            in_config = value == "begin"
+            continue
+        if in_config:
+            stats["config"][key] = value
+            continue
+
+        time_match = GCODE_TIME_RE.match(lower_key)
+        if time_match:
+            target = "first_layer_times" if time_match.group(1) else "times"
+            stats[target][time_match.group(2)] = value
+            continue
+
+        field = GCODE_FOOTER_FIELDS.get(lower_key)
+        if field:
+            number = parse_footer_number(value, field[1])
+            # "total ..." lines come after the per-extruder ones and win
+            if number is not None and (stats[field[0]] is None or lower_key.startswith("total")):
+                stats[field[0]] = number
+
+    times = stats["times"]
+    if times:
+        stats["time"] = times.get("normal") or next(iter(times.values()))
+        stats["time_seconds"] = duration_seconds(stats["time"])
+        stats["finish_time"] = estimate_finish_time(stats["time"])
+
+    # Older PrusaSlicer builds don't print a layer count, so derive it from the heights
+    if stats["layer_count"] is None and stats["max_layer_z"]:
+        try:
+            first = float(stats["config"].get("first_layer_height", "0").rstrip("%"))
+            height = float(stats["config"].get("layer_height", "0"))
+            if height > 0:
+                stats["layer_count"] = 1 + max(0, round((stats["max_layer_z"] - first) / height))
+        except ValueError:
+            pass
+
+    return stats
+
+
+# The slicer runs as a managed child process: its output is streamed for progress lines
+# ("45 => Making infill"), and a user cancel kills it straight away so the worker is freed.
+SLICE_TIMEOUT = 180
+SLICE_CANCELLED = "Slice cancelled."
+SLICER_PROGRESS_RE = re.compile(r"^\s*(\d{1,3})\s*=>\s*(.+)$")
+
+def new_slice_control(total=1):
+    """Shared state between a slice job and the UI: progress per output file, live processes, cancel flag."""
+    return {"cancel": threading.Event(), "lock": threading.Lock(), "processes": set(), "progress": {}, "stage": "Starting", "total": total}
+
+def report_slice_progress(control, key, percent, stage):
+    if control is None:
+        return
+    with control["lock"]:
+        control["progress"][key] = min(100, percent)
+        control["stage"] = stage
+
+def slice_progress(control):
+    """(0-1 overall progress, latest stage text) across every slice sharing this control."""
+    with control["lock"]:
+        done = sum(control["progress"].values())
+        return min(1.0, done / (100.0 * max(1, control["total"]))), control["stage"]
+
+def kill_process_tree(process):
+    if process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)  # AppRun may have started the real slicer as a child
+    except (AttributeError, OSError):
+        process.kill()
+
+def cancel_slice(control):
+    control["cancel"].set()
+    with control["lock"]:
+        processes = list(control["processes"])
+    for process in processes:
+        kill_process_tree(process)
+
+@st.cache_resource
+def get_slicer_slots():
+    """
+    One process-wide cap on live slicer processes, shared by single slices and fleet fan-outs,
+    so slicers never outnumber what the box was sized for (see NAPKIN_SLICER_PROCESSES).
+    """
+    return threading.BoundedSemaphore(SLICER_PROCESS_LIMIT or max(STAGE_WORKERS["slice"], FLEET_SLICE_WORKERS))
 
-def run_slicing_workflow(stl_path, gcode_path, full_config_name, user_overrides, p_settings):
+def run_slicer_process(command, env, control=None, progress_key=None):
+    """
+    Runs the slicer, streaming its output for progress. Returns (returncode, output tail, timed_out).
+    Waits for a free slicer slot first. The process is killed after SLICE_TIMEOUT seconds or as
+    soon as the control is cancelled.
+    """
+    slots = get_slicer_slots()
+    while not slots.acquire(timeout=0.5):
+        report_slice_progress(control, progress_key, 0, "Waiting for a free slicer")
+        if control is not None and control["cancel"].is_set():
+            return -1, "", False
+    try:
+        return run_slicer_child(command, env, control, progress_key)
+    finally:
+        slots.release()
+
+def run_slicer_child(command, env, control, progress_key):
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace",
+        env=env, start_new_session=True, bufsize=1
+    )
+    timed_out = threading.Event()
+
+    def on_timeout():
+        timed_out.set()
+        kill_process_tree(process)
+
+    timer = threading.Timer(SLICE_TIMEOUT, on_timeout)
+    timer.daemon = True
+    timer.start()
+    if control is not None:
+        with control["lock"]:
+            control["processes"].add(process)
+        if control["cancel"].is_set():
+            kill_process_tree(process)  # Cancelled between the check and the launch
+
+    tail = deque(maxlen=40)
+    try:
+        for line in process.stdout:
+            line = line.rstrip()
+            if not line:
+                continue
+            tail.append(line)
+            match = SLICER_PROGRESS_RE.match(line)
+            if match:
+                report_slice_progress(control, progress_key, int(match.group(1)), match.group(2).strip())
+        returncode = process.wait()
+    finally:
+        # If reading the output failed, nothing else is left to stop the slicer once the timer is gone
+        if process.poll() is None:
+            kill_process_tree(process)
+            process.wait()
+        timer.cancel()
+        process.stdout.close()
+        if control is not None:
+            with control["lock"]:
+                control["processes"].discard(process)
+    return returncode, "\n".join(tail), timed_out.is_set()
+
+
+def run_slicing_workflow(stl_path, gcode_path, full_config_name, user_overrides, p_settings, control=None):
     # 1. Setup Paths
-    exe = os.path.abspath("./Slicer")
+    slicer_command = get_slicer_command()
     stl_abs = os.path.abspath(stl_path)
     gcode_abs = os.path.abspath(gcode_path)
     
     recipe_filename = f"{full_config_name}.ini"
-    config_path = os.path.abspath(os.path.join("recipes", recipe_filename))
+    recipe = get_recipe(full_config_name)
     
-    if not os.path.exists(config_path):
+    if recipe is None:
         return False, f"Missing recipe: {recipe_filename}"
-    if not os.path.exists(exe):
+    if not slicer_command:
         return False, "Slicer binary missing."
+    if control is not None and control["cancel"].is_set():
+        return False, SLICE_CANCELLED
+
+    # Recipe + fleet overrides merged into one file, shared by every slice of the same combination
+    try:
+        config_path, config_digest = compile_slice_config(recipe["path"], user_overrides)
+    except OSError as e:
+        return False, f"Recipe Error: {e}"
 
-    os.chmod(exe, 0o755)
+    # Same STL + compiled config + post-processing = same G-code, so skip the slicer
+    cache_key = slice_cache_key(stl_abs, config_digest, p_settings)
+    cached_stats = slice_cache_get(cache_key, gcode_abs)
+    if cached_stats is not None:
+        report_slice_progress(control, gcode_abs, 100, "Loaded from slice cache")
+        return True, cached_stats
 
     # 2. Build the Command
-    command = [
-        exe, "--appimage-extract-and-run",
+    command = slicer_command + [
         "--slice", 
-        "--load", config_path,
+        "--load", os.path.abspath(config_path),
         "--output", gcode_abs,
-        "--fill-density", f"{user_overrides['infill']}%",
-        "--perimeters", str(user_overrides['walls'])
+        stl_abs
     ]
     
-    if user_overrides['supports'] == "ON":
-        command.append("--support-material")
-    else:
-        command.append("--no-support-material")
-
-    command.append(stl_abs)
-    
     # 3. Execution
     env = os.environ.copy()
     env["QT_QPA_PLATFORM"] = "offscreen"
 
     try:
-        # --- FIX: INITIALIZE STATS HERE ---
-        stats = {"time": "Unknown", "finish_time": "Unknown"}
-
         # Run the process
-        subprocess.run(command, capture_output=True, text=True, check=True, env=env, timeout=180)
+        report_slice_progress(control, gcode_abs, 0, "Starting slicer")
+        returncode, output, timed_out = run_slicer_process(command, env, control, gcode_abs)
+        if control is not None and control["cancel"].is_set():
+            return False, SLICE_CANCELLED
+        if timed_out:
+            return False, f"Slicer timed out after {SLICE_TIMEOUT}s."
+        if returncode != 0:
+            return False, f"Slicer Error: {output}"
         
         # --- FIX: METADATA EXTRACTION ---
         if os.path.exists(gcode_abs):
             
-            # --- ADDED: BAMBU POST-PROCESSING ---
-            # This only runs if p_settings['brand'] contains 'Bambu'
-            apply_bambu_overrides(gcode_abs, p_settings['brand'], p_settings['model'])
+            # --- BRAND/MODEL POST-PROCESSING ---
+            # e.g. the Bambu header/footer, only for printers with a registered pass
+            post_process_gcode(gcode_abs, p_settings['brand'], p_settings['model'])
             
-            with open(gcode_abs, 'r') as f:
-                # Read end of file for PrusaSlicer metadata (usually in the last 30kb)
-                f.seek(0, os.SEEK_END)
-                f.seek(max(0, f.tell() - 30000))
-                content = f.read()
-                
-                # Look for duration string (e.g., "estimated printing time = 1h 20m")
-                t_match = re.search(r"estimated printing time.*=\s*(.*)", content, re.IGNORECASE)
-                
-                if t_match:
-                    duration_str = t_match.group(1).strip()
-                    stats["time"] = duration_str
-                    
-                    # Time Math for Finish Time
-                    try:
-                        h_match = re.search(r'(\d+)h', duration_str)
-                        m_match = re.search(r'(\d+)m', duration_str)
-                        s_match = re.search(r'(\d+)s', duration_str)
-                        
-                        hours = int(h_match.group(1)) if h_match else 0
-                        minutes = int(m_match.group(1)) if m_match else 0
-                        seconds = int(s_match.group(1)) if s_match else 0
-                        
-                        total_duration = timedelta(hours=hours, minutes=minutes, seconds=seconds)
-                        finish_dt = datetime.now() + total_duration
-                        stats["finish_time"] = finish_dt.strftime("%I:%M %p")
-                    except:
-                        stats["finish_time"] = "Calc Error"
+            # Footer metadata (time, filament, layers, config), cached with the G-code
+            stats = parse_gcode_metadata(gcode_abs)
 
+            slice_cache_put(cache_key, gcode_abs, stats)
+            report_slice_progress(control, gcode_abs, 100, "Done")
             return True, stats
         
         return False, "G-code file not generated."
 
-    except subprocess.CalledProcessError as e:
-        return False, f"Slicer Error: {e.stderr}"
     except Exception as e:
         return False, f"System Error: {str(e)}"
     
     
 
+# --- SHARED CACHE HELPERS ---
+CACHE_ROOT = ".napkin_cache"
+
+@st.cache_resource
+def get_cache_counters():
+    """Process-wide hit/miss counters, shared by every session on this server."""
+    return {"lock": threading.Lock(), "counts": {}}
+
+def bump_cache_counter(name, amount=1):
+    counters = get_cache_counters()
+    with counters["lock"]:
+        counters["counts"][name] = counters["counts"].get(name, 0) + amount
+
+def evict_lru_files(folder, max_bytes):
+    """Deletes the least recently used files in a cache folder until it fits under max_bytes."""
+    if not os.path.exists(folder):
+        return 0
+
+    entries = []
+    for fn in os.listdir(folder):
+        path = os.path.join(folder, fn)
+        try:
+            st_info = os.stat(path)
+        except OSError:
+            continue
+        if os.path.isfile(path):
+            entries.append((st_info.st_mtime, st_info.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+    # Oldest modification time first (cache hits bump the mtime)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            evicted += 1
+        except OSError:
+            pass
+    return evicted
+
+
+# --- PROMPT CONTEXT CACHE ---
+# The library text and gold-standard examples are assembled once per process and shared
+# by every session. Libraries are invalidated by file mtime/size; the Corrected sheet is
+# indexed once and kept current by Admin saves (plus a TTL to pick up direct sheet edits).
+TRAINING_INDEX_TTL = 600
+TRAINING_TOP_K = 4
+TRAINING_TOKEN_BUDGET = 3000  # Approximate prompt tokens (~4 characters each) for examples
+
+def get_library_signature(library_folder="libraries"):
+    """(filename, mtime, size) for every file in a folder (libraries/ unless told otherwise)."""
+    signature = []
+    if os.path.exists(library_folder):
+        for fn in sorted(os.listdir(library_folder)):
+            path = os.path.join(library_folder, fn)
+            if os.path.isfile(path):
+                info = os.stat(path)
+                signature.append((fn, info.st_mtime_ns, info.st_size))
+    return tuple(signature)
+
+@st.cache_data(show_spinner=False)
+def build_library_context(signature, library_folder="libraries"):
+    library_context = ""
+    for fn, _, _ in signature:
+        if fn.endswith(".scad"):
+            with open(os.path.join(library_folder, fn), "r") as f:
+                library_context += f"\n--- LIBRARY: {fn} ---\n{f.read()}\n"
+    return library_context
+
+@st.cache_data(show_spinner=False)
+def build_library_fingerprint(signature, library_folder="libraries"):
+    """Hashes the name and contents of every file in the libraries folder."""
+    digest = hashlib.sha256()
+    for fn, _, _ in signature:
+        digest.update(fn.encode("utf-8"))
+        with open(os.path.join(library_folder, fn), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def get_library_context():
+    return build_library_context(get_library_signature())
+
+def get_library_fingerprint():
+    return build_library_fingerprint(get_library_signature())
+
+# --- GOLD STANDARD RETRIEVAL (BM25 over Prompt + Logic) ---
+# Only the examples most relevant to the user's specification go into the prompt,
+# so prompt size stays flat as the Corrected vault grows.
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def tokenize(text):
+    return TOKEN_RE.findall(str(text).lower())
+
+def new_training_index():
+    return {"docs": [], "doc_freq": {}, "total_len": 0}
+
+@st.cache_resource
+def get_training_index():
+    index = new_training_index()
+    index.update({"lock": threading.Lock(), "version": 0, "loaded_at": 0.0})
+    return index
+
+def index_training_example(index, prompt, logic, code):
+    tokens = tokenize(f"{prompt} {logic}")
+    term_counts = Counter(tokens)
+    index["docs"].append({"prompt": prompt, "logic": logic, "code": code, "tf": term_counts, "length": len(tokens)})
+    for term in term_counts:
+        index["doc_freq"][term] = index["doc_freq"].get(term, 0) + 1
+    index["total_len"] += len(tokens)
+
+def refresh_training_index(force=False):
+    """Rebuilds the index from the Corrected sheet at most once per TRAINING_INDEX_TTL."""
+    index = get_training_index()
+    with index["lock"]:
+        if not force and index["loaded_at"] and time.time() - index["loaded_at"] < TRAINING_INDEX_TTL:
+            return index
+
+        # Errors propagate so a failed read is retried on the next generation
+        training_df = read_sheet("Corrected")
+        fresh = new_training_index()
+        digest = hashlib.sha256()
+        for _, row in training_df.iterrows():
+            clean_code = str(row['Code']).replace(" [NEWLINE] ", "\n")
+            index_training_example(fresh, row['Prompt'], row['Logic'], clean_code)
+            digest.update(f"{row['Prompt']}\x1f{row['Logic']}\x1f{clean_code}\x1e".encode("utf-8"))
+
+        # Only a real content change bumps the version (it is part of the generation cache key)
+        if digest.hexdigest() != index.get("digest"):
+            index.update(fresh)
+            index["digest"] = digest.hexdigest()
+            index["version"] += 1
+        index["loaded_at"] = time.time()
+    return index
+
+def add_training_example(prompt, logic, code):
+    """Adds a newly saved Corrected row to the live index without re-reading the sheet."""
+    index = get_training_index()
+    with index["lock"]:
+        index_training_example(index, prompt, logic, code)
+        index["digest"] = None
+        index["version"] += 1
+
+def get_training_version():
+    return get_training_index()["version"]
+
+def select_training_examples(query, top_k=TRAINING_TOP_K, token_budget=TRAINING_TOKEN_BUDGET):
+    index = get_training_index()
+    with index["lock"]:
+        docs = list(index["docs"])
+        doc_freq = dict(index["doc_freq"])
+        avg_len = index["total_len"] / len(docs) if docs else 0
+
+    if not docs:
+        return []
+
+    query_terms = set(tokenize(query))
+    scored = []
+    for i, doc in enumerate(docs):
+        score = 0.0
+        for term in query_terms:
+            tf = doc["tf"].get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc["length"] / max(avg_len, 1))
+            score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        # Newer rows win ties, so an unmatched query still gets the latest syntax examples
+        scored.append((score, i, doc))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+
+    selected = []
+    used_tokens = 0
+    for score, _, doc in scored:
+        if len(selected) >= top_k:
+            break
+        doc_tokens = (len(str(doc["prompt"])) + len(str(doc["logic"])) + len(doc["code"])) // 4
+        if selected and used_tokens + doc_tokens > token_budget:
+            continue
+        selected.append(doc)
+        used_tokens += doc_tokens
+    return selected
+
+def get_training_context(query=""):
+    try:
+        refresh_training_index()
+    except Exception:
+        pass # Serve whatever is already indexed
+
+    examples = select_training_examples(query)
+    if not examples:
+        return ""
+    training_context = "\n--- GOLD STANDARD EXAMPLES ---\n"
+    for doc in examples:
+        training_context += f"/* PROMPT: {doc['prompt']} \n LOGIC: {doc['logic']} \n CODE: \n {doc['code']} */\n\n"
+    return training_context
+
+
+# --- GENERATION RESPONSE CACHE ---
+# Identical requests (same spec, sketch type, image and knowledge base) reuse the stored
+# logic + code instead of paying for another Gemini call.
+GENERATION_CACHE_MAX_ENTRIES = 256
+GENERATION_CACHE_TTL = 24 * 60 * 60
+
+@st.cache_resource
+def get_generation_cache():
+    return {"lock": threading.Lock(), "entries": OrderedDict()}
+
+def image_hash(img):
+    if img is None:
+        return ""
+    digest = hashlib.sha256()
+    digest.update(f"{img.mode}{img.size}".encode("utf-8"))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+def generation_cache_key(user_context, sketch_type, img):
+    normalized = " ".join(str(user_context).lower().split())
+    parts = [normalized, sketch_type, image_hash(img), get_library_fingerprint(), str(get_training_version())]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def generation_cache_get(key):
+    """Returns (code, logic) for a fresh cached generation, or None."""
+    cache = get_generation_cache()
+    with cache["lock"]:
+        entry = cache["entries"].get(key)
+        if entry and time.time() - entry["stored"] < GENERATION_CACHE_TTL:
+            cache["entries"].move_to_end(key)
+            hit = (entry["code"], entry["logic"])
+        else:
+            cache["entries"].pop(key, None)
+            hit = None
+    bump_cache_counter("generation_hits" if hit else "generation_misses")
+    return hit
+
+def generation_cache_put(key, code, logic):
+    cache = get_generation_cache()
+    with cache["lock"]:
+        cache["entries"][key] = {"code": code, "logic": logic, "stored": time.time()}
+        cache["entries"].move_to_end(key)
+        while len(cache["entries"]) > GENERATION_CACHE_MAX_ENTRIES:
+            cache["entries"].popitem(last=False)
+
+
+# --- SCAD STATIC VALIDATOR ---
+# Catches trivially broken code (leftover fences, unbalanced brackets, missing includes)
+# in-process, before paying for an OpenSCAD process spawn. Calls to names it doesn't
+# know are only warnings: the builtin list is kept by hand, so OpenSCAD gets the final say.
+SCAD_BUILTINS = {
+    # 2D / 3D primitives
+    "cube", "sphere", "cylinder", "polyhedron", "square", "circle", "polygon", "text", "import",
+    "surface",
+    # Transformations and booleans
+    "translate", "rotate", "scale", "resize", "mirror", "multmatrix", "color", "offset", "hull",
+    "minkowski", "union", "difference", "intersection", "linear_extrude", "rotate_extrude",
+    "projection", "render", "children", "group", "intersection_for",
+    # Experimental (manifold / dev snapshots)
+    "roof", "fill", "textmetrics", "fontmetrics", "object",
+    # Deprecated, still accepted with a warning
+    "assign", "child", "import_stl", "import_off", "import_dxf", "dxf_linear_extrude",
+    "dxf_rotate_extrude", "dxf_cross", "dxf_dim",
+    # Math
+    "abs", "sign", "sin", "cos", "tan", "acos", "asin", "atan", "atan2", "floor", "round", "ceil",
+    "ln", "log", "pow", "sqrt", "exp", "rands", "min", "max", "norm", "cross",
+    # Lists and strings
+    "len", "concat", "lookup", "str", "chr", "ord", "search",
+    # Type tests and introspection
+    "is_undef", "is_bool", "is_num", "is_string", "is_list", "is_function", "is_object",
+    "version", "version_num", "parent_module",
+    # Keywords that take parentheses
+    "if", "for", "let", "each", "assert", "echo", "function",
+}
+SCAD_MULTI_CHAR_PUNCT = ("==", "!=", "<=", ">=", "&&", "||")
+
+def tokenize_scad(code):
+    """
+    Splits SCAD source into (kind, text, line, col) tokens, skipping comments.
+    kind is 'ident', 'number', 'string', 'include' (text is the <path>) or 'punct'.
+    Returns (tokens, errors).
+    """
+    tokens = []
+    errors = []
+    i, line, line_start = 0, 1, 0
+    n = len(code)
+
+    while i < n:
+        ch = code[i]
+        col = i - line_start + 1
+
+        if ch == "\n":
+            line += 1
+            line_start = i + 1
+            i += 1
+        elif ch.isspace():
+            i += 1
+        elif code.startswith("//", i):
+            end = code.find("\n", i)
+            i = n if end == -1 else end
+        elif code.startswith("/*", i):
+            end = code.find("*/", i + 2)
+            if end == -1:
+                errors.append(f"line {line}:{col}: comment '/*' is never closed")
+                break
+            line += code.count("\n", i, end)
+            last_nl = code.rfind("\n", i, end)
+            if last_nl != -1:
+                line_start = last_nl + 1
+            i = end + 2
+        elif ch == '"':
+            j = i + 1
+            while j < n and code[j] != '"' and code[j] != "\n":
+                j += 2 if code[j] == "\\" else 1
+            if j >= n or code[j] != '"':
+                errors.append(f"line {line}:{col}: string is never closed")
+                i = j
+            else:
+                tokens.append(("string", code[i:j + 1], line, col))
+                i = j + 1
+        elif ch.isalpha() or ch in "_$":
+            j = i + 1
+            while j < n and (code[j].isalnum() or code[j] in "_$"):
+                j += 1
+            word = code[i:j]
+            k = j
+            while k < n and code[k] in " \t":
+                k += 1
+            if word in ("include", "use") and k < n and code[k] == "<":
+                end = code.find(">", k)
+                if end == -1 or "\n" in code[k:end]:
+                    errors.append(f"line {line}:{col}: '{word} <' is missing its closing '>'")
+                    i = j
+                else:
+                    tokens.append(("include", code[k + 1:end].strip(), line, col))
+                    i = end + 1
+            else:
+                tokens.append(("ident", word, line, col))
+                i = j
+        elif ch.isdigit() or (ch == "." and i + 1 < n and code[i + 1].isdigit()):
+            j = i + 1
+            while j < n and (code[j].isdigit() or code[j] == "." or code[j] in "eE" or (code[j] in "+-" and code[j - 1] in "eE")):
+                j += 1
+            tokens.append(("number", code[i:j], line, col))
+            i = j
+        else:
+            punct = next((p for p in SCAD_MULTI_CHAR_PUNCT if code.startswith(p, i)), ch)
+            tokens.append(("punct", punct, line, col))
+            i += len(punct)
+
+    return tokens, errors
+
+@st.cache_data(show_spinner=False)
+def build_library_symbols(signature, library_folder="libraries"):
+    """Maps every module/function defined in libraries/*.scad to the file that defines it."""
+    symbols = {}
+    for fn, _, _ in signature:
+        if not fn.endswith(".scad"):
+            continue
+        with open(os.path.join(library_folder, fn), "r") as f:
+            tokens, _ = tokenize_scad(f.read())
+        for prev, tok in zip(tokens, tokens[1:]):
+            if prev[0] == "ident" and prev[1] in ("module", "function") and tok[0] == "ident":
+                symbols.setdefault(tok[1], fn)
+    return symbols
+
+@st.cache_data(show_spinner=False)
+def build_library_includes(signature, library_folder="libraries"):
+    """Maps every libraries/*.scad file to the library files it includes or uses."""
+    graph = {}
+    for fn, _, _ in signature:
+        if not fn.endswith(".scad"):
+            continue
+        with open(os.path.join(library_folder, fn), "r") as f:
+            tokens, _ = tokenize_scad(f.read())
+        graph[fn] = []
+        for kind, text, _, _ in tokens:
+            resolved = resolve_scad_include(text) if kind == "include" else None
+            if resolved:
+                graph[fn].append(os.path.basename(resolved))
+    return graph
+
+def get_library_symbols():
+    return build_library_symbols(get_library_signature())
+
+def get_library_includes():
+    return build_library_includes(get_library_signature())
+
+def scad_library_dirs():
+    """Where OpenSCAD itself looks for include/use files: OPENSCADPATH, then the user and system library folders."""
+    dirs = [d for d in os.environ.get("OPENSCADPATH", "").split(os.pathsep) if d]
+    home = os.path.expanduser("~")
+    if sys.platform in ("win32", "darwin"):
+        dirs.append(os.path.join(home, "Documents", "OpenSCAD", "libraries"))
+    else:
+        dirs.append(os.path.join(os.environ.get("XDG_DATA_HOME") or os.path.join(home, ".local", "share"), "OpenSCAD", "libraries"))
+        dirs += ["/usr/local/share/openscad/libraries", "/usr/share/openscad/libraries"]
+    return dirs
+
+def resolve_scad_include(path):
+    for folder in ["", "libraries"] + scad_library_dirs():
+        candidate = os.path.join(folder, path)
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+def validate_scad(code):
+    """
+    Returns (errors, warnings) as lists of precise strings. Any error means the code is not
+    worth rendering; warnings (calls to names we don't recognise) are passed on to OpenSCAD.
+    """
+    errors = []
+    warnings = []
+    for line_no, text in enumerate(code.splitlines(), start=1):
+        if "```" in text:
+            errors.append(f"line {line_no}: leftover markdown fence '```'")
+
+    tokens, scan_errors = tokenize_scad(code)
+    errors += scan_errors
+
+    # 1. Bracket balance
+    closers = {")": "(", "]": "[", "}": "{"}
+    stack = []
+    for kind, text, line, col in tokens:
+        if kind != "punct":
+            continue
+        if text in "([{":
+            stack.append((text, line, col))
+        elif text in closers:
+            if not stack:
+                errors.append(f"line {line}:{col}: unexpected '{text}' with nothing to close")
+            else:
+                opener, o_line, o_col = stack.pop()
+                if opener != closers[text]:
+                    errors.append(f"line {line}:{col}: '{text}' does not match '{opener}' opened at line {o_line}:{o_col}")
+    for opener, line, col in stack:
+        errors.append(f"line {line}:{col}: '{opener}' is never closed")
+
+    # 2. Include paths
+    included = set()
+    for kind, text, line, col in tokens:
+        if kind == "include":
+            resolved = resolve_scad_include(text)
+            if resolved:
+                included.add(os.path.basename(resolved))
+            else:
+                # OpenSCAD only warns about a missing include too, and it may know paths we don't
+                warnings.append(f"line {line}:{col}: include file <{text}> not found")
+
+    # Library files pull in other library files (ai_training.scad -> iso_standards.scad)
+    library_includes = get_library_includes()
+    to_visit = list(included)
+    while to_visit:
+        for nested in library_includes.get(to_visit.pop(), []):
+            if nested not in included:
+                included.add(nested)
+                to_visit.append(nested)
+
+    # 3. Module / function calls
+    defined = set()
+    for i, (kind, text, line, col) in enumerate(tokens):
+        if kind != "ident":
+            continue
+        if i > 0 and tokens[i - 1][1] in ("module", "function"):
+            defined.add(text)
+        elif i + 1 < len(tokens) and tokens[i + 1][1] == "=":
+            defined.add(text) # Variables can hold function literals
+
+    library_symbols = get_library_symbols()
+    reported = set()
+    for i, (kind, text, line, col) in enumerate(tokens):
+        if kind != "ident" or i + 1 >= len(tokens) or tokens[i + 1][1] != "(":
+            continue
+        if (i > 0 and tokens[i - 1][1] in ("module", "function")) or text in SCAD_BUILTINS or text in defined or text in reported:
+            continue
+        if text in library_symbols:
+            if library_symbols[text] not in included:
+                errors.append(f"line {line}:{col}: '{text}' is defined in libraries/{library_symbols[text]} but the code never includes it")
+                reported.add(text)
+        else:
+            warnings.append(f"line {line}:{col}: unknown module or function '{text}'")
+            reported.add(text)
+
+    return errors, warnings
+
+
+# --- OPENSCAD RENDER CACHE ---
+RENDER_CACHE_DIR = os.path.join(CACHE_ROOT, "renders")
+RENDER_CACHE_MAX_BYTES = 500 * 1024 * 1024  # LRU eviction above 500 MB
+
+# Draft renders cap $fn and use the manifold backend when this OpenSCAD has it, so the
+# on-screen preview appears quickly; the full-resolution STL is only built for download/slicing.
+DRAFT_PREVIEW = os.environ.get("NAPKIN_DRAFT_PREVIEW", "1") != "0"
+DRAFT_FN = 16
+PREVIEW_STL = "part_draft.stl" if DRAFT_PREVIEW else "part.stl"
+FN_ASSIGN_RE = re.compile(r"(\$fn\s*=\s*)(\d+(?:\.\d+)?)")
+
+def draft_scad_code(scad_code):
+    """Caps every literal '$fn = N' at DRAFT_FN."""
+    return FN_ASSIGN_RE.sub(lambda m: f"{m.group(1)}{min(float(m.group(2)), DRAFT_FN):g}", scad_code)
+
+def get_draft_library_root():
+    """
+    Folder holding low-$fn copies of libraries/, one per library version. Putting it first on
+    OPENSCADPATH makes 'include <libraries/...>' pick up the draft copies.
+    """
+    root = os.path.abspath(os.path.join(CACHE_ROOT, "draft_libraries", get_library_fingerprint()[:16]))
+    if not os.path.isdir(root):
+        os.makedirs(os.path.dirname(root), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix="staging_", dir=os.path.dirname(root))
+        os.makedirs(os.path.join(staging, "libraries"))
+        for fn, _, _ in get_library_signature():
+            with open(os.path.join("libraries", fn), "r") as f:
+                content = f.read()
+            with open(os.path.join(staging, "libraries", fn), "w") as f:
+                f.write(draft_scad_code(content) if fn.endswith(".scad") else content)
+        try:
+            os.rename(staging, root)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True) # Another session got there first
+    return root
+
+@st.cache_resource
+def get_draft_backend_flags(exe):
+    """['--backend=manifold'] (or the older '--enable=manifold') if this OpenSCAD build supports it."""
+    try:
+        result = subprocess.run([exe, "--help"], capture_output=True, text=True, timeout=15)
+        help_text = result.stdout + result.stderr
+    except Exception:
+        return []
+    if "--backend" in help_text:
+        return ["--backend=manifold"]
+    if "manifold" in help_text:
+        return ["--enable=manifold"]
+    return []
+
+def render_cache_key(scad_code, variant=""):
+    """Content address for a render: the SCAD source, the render variant and the current library versions."""
+    digest = hashlib.sha256()
+    digest.update(scad_code.encode("utf-8"))
+    digest.update(variant.encode("utf-8"))
+    digest.update(get_library_fingerprint().encode("utf-8"))
+    return digest.hexdigest()
+
+def render_cache_get(key, stl_path):
+    """Copies a cached STL to stl_path. Returns True on a cache hit."""
+    cached = os.path.join(RENDER_CACHE_DIR, f"{key}.stl")
+    if os.path.exists(cached):
+        try:
+            shutil.copyfile(cached, stl_path)
+            os.utime(cached)  # Mark as recently used for LRU eviction
+            bump_cache_counter("render_hits")
+            return True
+        except OSError:
+            pass
+    bump_cache_counter("render_misses")
+    return False
+
+def render_cache_put(key, stl_path):
+    try:
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        cached = os.path.join(RENDER_CACHE_DIR, f"{key}.stl")
+        # Write to a temp name first so other sessions never read a half-copied STL
+        tmp_path = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(stl_path, tmp_path)
+        os.replace(tmp_path, cached)
+        bump_cache_counter("render_evictions", evict_lru_files(RENDER_CACHE_DIR, RENDER_CACHE_MAX_BYTES))
+    except OSError:
+        pass # A cache write failure should never fail the render itself
+
+def render_scad_to_stl(exe, scad_code, scad_path, stl_path, draft=False):
+    """
+    Renders SCAD code to an STL, reusing a cached STL when the code and libraries are unchanged.
+    draft=True renders a low-$fn preview instead of the full-resolution part.
+    Returns (success, log_text, cache_hit).
+    """
+    key = render_cache_key(scad_code, f"draft-fn{DRAFT_FN}" if draft else "")
+    if render_cache_get(key, stl_path):
+        return True, "", True
+
+    static_errors, static_warnings = validate_scad(scad_code)
+    warning_log = "".join(f"WARNING: {w}\n" for w in static_warnings)
+    if static_errors:
+        bump_cache_counter("validator_rejects")
+        return False, "\n".join(f"ERROR: {e}" for e in static_errors) + "\n" + warning_log, False
+    if static_warnings:
+        bump_cache_counter("validator_warnings")
+
+    with open(scad_path, "w") as f:
+        f.write(draft_scad_code(scad_code) if draft else scad_code)
+
+    # The SCAD file lives in a session workspace, so 'include <libraries/...>' has to
+    # resolve against the app folder rather than the folder the file sits in
+    search_path = [os.getcwd(), os.path.join(os.getcwd(), "libraries")]
+    command = [exe, "-o", stl_path, scad_path]
+    if draft:
+        draft_root = get_draft_library_root()
+        search_path = [draft_root, os.path.join(draft_root, "libraries")] + search_path
+        command[1:1] = get_draft_backend_flags(exe)
+
+    my_env = os.environ.copy()
+    # Keep any OPENSCADPATH the server was started with, so MCAD/BOSL2 installs there still resolve
+    my_env["OPENSCADPATH"] = os.pathsep.join(search_path + [d for d in my_env.get("OPENSCADPATH", "").split(os.pathsep) if d])
+    result = subprocess.run(command, env=my_env, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        return False, warning_log + result.stderr, False
+
+    render_cache_put(key, stl_path)
+    return True, warning_log + result.stderr, False
+    
+
+# --- SKETCH BLOB STORE ---
+# Feedback sketches are saved once on disk under their SHA-256 and only the
+# "blob:<hash>" reference goes into the sheet, so Pending/Corrected rows stay small
+# and the same sketch logged twice is stored once. Older rows still hold base64.
+#
+# The blob holds the only copy of a sketch, so it can't live in CACHE_ROOT (disposable) or on
+# an ephemeral disk. It is only used when NAPKIN_DATA_DIR points at durable storage (a root-level
+# secret of that name works too, Streamlit exports those as env vars); without it the sketch
+# stays in the sheet as base64, as before.
+DATA_ROOT = os.environ.get("NAPKIN_DATA_DIR", "")
+BLOB_DIR = os.path.join(DATA_ROOT or "napkin_data", "blobs")
+BLOB_DURABLE = bool(DATA_ROOT)
+BLOB_PREFIX = "blob:"
+
+def blob_path(ref):
+    """Maps a 'blob:<hash>' reference to its file, or None for anything else (e.g. legacy base64)."""
+    digest = str(ref)[len(BLOB_PREFIX):] if str(ref).startswith(BLOB_PREFIX) else ""
+    if not re.fullmatch(r"[0-9a-f]{64}", digest):
+        return None
+    # Fan out on the first two hex chars so one folder never holds every sketch
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+def store_blob(data):
+    """
+    Saves bytes under their content hash and returns the reference to put in the sheet.
+    Without durable storage the bytes themselves go in the sheet, base64-encoded.
+    """
+    if not BLOB_DURABLE:
+        return base64.b64encode(data).decode("ascii")
+
+    ref = BLOB_PREFIX + hashlib.sha256(data).hexdigest()
+    path = blob_path(ref)
+    if os.path.exists(path):
+        bump_cache_counter("blob_dedup_hits")
+        return ref
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    bump_cache_counter("blob_writes")
+    return ref
+
+
+# --- PER-SESSION WORKSPACES ---
+# Every session gets its own scratch folder, and every generation a fresh sub-folder
+# (see workspaces.py, which app.py uses too). Idle folders are swept at most every
+# WORKSPACE_SWEEP_INTERVAL, not on every rerun.
+sweep_idle_workspaces()
+if st.session_state.get("workspace_dir"):
+    get_session_workspace()
+
+
+# --- SLICER RUNTIME ---
+# The slicer AppImage is unpacked once per version into a cached runtime folder and
+# launched directly, instead of paying for --appimage-extract-and-run on every slice.
+SLICER_APPIMAGE = "./Slicer"
+SLICER_RUNTIME_ROOT = os.path.join(CACHE_ROOT, "slicer_runtime")
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def slicer_appimage_version(appimage):
+    """SHA-256 of the AppImage, remembered against its size/mtime so restarts don't re-hash 100+ MB."""
+    info = os.stat(appimage)
+    stamp = f"{info.st_size}-{info.st_mtime_ns}"
+    stamp_file = os.path.join(SLICER_RUNTIME_ROOT, "appimage.version")
+    try:
+        with open(stamp_file, "r") as f:
+            saved_stamp, saved_version = f.read().split()
+        if saved_stamp == stamp:
+            return saved_version
+    except (OSError, ValueError):
+        pass
+
+    version = file_sha256(appimage)
+    os.makedirs(SLICER_RUNTIME_ROOT, exist_ok=True)
+    with open(stamp_file, "w") as f:
+        f.write(f"{stamp} {version}")
+    return version
+
+def verify_slicer_runtime(runtime_dir):
+    """Integrity check: every extracted file is still there with the size recorded at extraction."""
+    try:
+        with open(os.path.join(runtime_dir, "manifest.json"), "r") as f:
+            manifest = json.load(f)
+        for rel_path, size in manifest.items():
+            if os.path.getsize(os.path.join(runtime_dir, rel_path)) != size:
+                return False
+    except (OSError, ValueError):
+        return False
+    return os.access(os.path.join(runtime_dir, "squashfs-root", "AppRun"), os.X_OK)
+
+def prepare_slicer_runtime(appimage=SLICER_APPIMAGE):
+    """
+    Returns the command prefix that launches the slicer, extracting the AppImage first if this
+    version hasn't been extracted yet. Falls back to --appimage-extract-and-run if extraction fails.
+    """
+    appimage = os.path.abspath(appimage)
+    if not os.path.exists(appimage):
+        return None
+    os.chmod(appimage, 0o755)
+    fallback = [appimage, "--appimage-extract-and-run"]
+
+    staging = None
+    try:
+        version = slicer_appimage_version(appimage)[:16]
+        runtime_dir = os.path.join(SLICER_RUNTIME_ROOT, version)
+        app_run = os.path.join(runtime_dir, "squashfs-root", "AppRun")
+        if verify_slicer_runtime(runtime_dir):
+            return [app_run]
+
+        shutil.rmtree(runtime_dir, ignore_errors=True)
+        staging = tempfile.mkdtemp(prefix="staging_", dir=SLICER_RUNTIME_ROOT)
+        subprocess.run([appimage, "--appimage-extract"], cwd=staging, capture_output=True, check=True, timeout=600)
+
+        manifest = {}
+        for dirpath, _, filenames in os.walk(os.path.join(staging, "squashfs-root")):
+            for fn in filenames:
+                path = os.path.join(dirpath, fn)
+                if not os.path.islink(path):
+                    manifest[os.path.relpath(path, staging)] = os.path.getsize(path)
+        with open(os.path.join(staging, "manifest.json"), "w") as f:
+            json.dump(manifest, f)
+
+        try:
+            os.rename(staging, runtime_dir)
+            staging = None
+        except OSError:
+            pass # Another process finished extracting first
+
+        # Drop runtimes left behind by older slicer versions
+        for fn in os.listdir(SLICER_RUNTIME_ROOT):
+            old_path = os.path.join(SLICER_RUNTIME_ROOT, fn)
+            if fn != version and os.path.isdir(old_path) and not fn.startswith("staging_"):
+                shutil.rmtree(old_path, ignore_errors=True)
+
+        if verify_slicer_runtime(runtime_dir):
+            return [app_run]
+    except Exception:
+        pass
+    finally:
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+    return fallback
+
+@st.cache_resource
+def get_slicer_runtime_future():
+    """Starts preparing the slicer runtime in the background when the server starts."""
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="napkin-slicer-setup").submit(prepare_slicer_runtime)
+
+def get_slicer_command():
+    try:
+        return get_slicer_runtime_future().result()
+    except Exception:
+        return None
+
+get_slicer_runtime_future()
+
+
+# --- COMPILED SLICE CONFIGS ---
+# The slicer gets one pre-merged .ini (recipe + fleet overrides) instead of the recipe plus
+# CLI overrides. Files are named by the hash of their content, so the same combination is
+# written once and two slices can be compared with a plain diff of their config files.
+CONFIG_CACHE_DIR = os.path.join(CACHE_ROOT, "configs")
+CONFIG_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def slice_override_settings(user_overrides):
+    """Fleet overrides as the recipe keys the old --fill-density/--perimeters/--support-material flags set."""
+    return {
+        "fill_density": f"{user_overrides['infill']}%",
+        "perimeters": str(user_overrides['walls']),
+        "support_material": "1" if user_overrides['supports'] == "ON" else "0",
+    }
+
+def merge_recipe_text(recipe_text, overrides):
+    """Rewrites the overridden keys in place (appending any the recipe lacks), keeping every other line as-is."""
+    remaining = dict(overrides)
+    lines = []
+    for line in recipe_text.splitlines():
+        key, sep, _ = line.partition("=")
+        key = key.strip()
+        if sep and not line.startswith("#") and key in remaining:
+            line = f"{key} = {remaining.pop(key)}"
+        lines.append(line)
+    lines.extend(f"{key} = {value}" for key, value in sorted(remaining.items()))
+    return "\n".join(lines) + "\n"
+
+def compile_slice_config(recipe_path, user_overrides):
+    """Returns (path, digest) of the merged config for this recipe + overrides, writing it on first use."""
+    with open(recipe_path, "r", encoding="utf-8") as f:
+        merged = merge_recipe_text(f.read(), slice_override_settings(user_overrides))
+    digest = hashlib.sha256(merged.encode("utf-8")).hexdigest()
+    config_path = os.path.join(CONFIG_CACHE_DIR, f"{digest}.ini")
+
+    if os.path.exists(config_path):
+        os.utime(config_path)  # Mark as recently used for LRU eviction
+        bump_cache_counter("config_hits")
+        return config_path, digest
+
+    os.makedirs(CONFIG_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{config_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(merged)
+    os.replace(tmp_path, config_path)
+    bump_cache_counter("config_misses")
+    bump_cache_counter("config_evictions", evict_lru_files(CONFIG_CACHE_DIR, CONFIG_CACHE_MAX_BYTES))
+    return config_path, digest
+
+
+# --- RECIPE TRANSLATOR ---
+# Converts Bambu/Orca exported profiles into PrusaSlicer recipes using the find/replace
+# table in "Recipe Instruction Document.txt", and checks the keys against a known-good
+# PrusaSlicer config. Conversions are cached by source + rules hash.
+RECIPE_TRANSLATION_TABLE = "Recipe Instruction Document.txt"
+RECIPE_REFERENCE = "config.ini"
+TRANSLATION_CACHE_DIR = os.path.join(CACHE_ROOT, "translations")
+TRANSLATION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+def split_recipe_line(line):
+    """(key, value) of a 'key = value' line, or (None, None) for comments and other lines."""
+    if line.startswith("#"):
+        return None, None
+    key, sep, value = line.partition("=")
+    if not sep or not key.strip():
+        return None, None
+    return key.strip(), value.strip()
+
+@st.cache_data(show_spinner=False)
+def load_translation_table(path, mtime_ns):
+    """{(orca key, orca value): (prusa key, prusa value)} from the find/replace CSV."""
+    table = {}
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # Header row
+        for row in reader:
+            if len(row) < 2:
+                continue
+            find, replace = split_recipe_line(row[0]), split_recipe_line(row[1])
+            if find[0] and replace[0]:
+                table[find] = replace
+    return table
+
+@st.cache_data(show_spinner=False)
+def load_reference_keys(path, mtime_ns):
+    return frozenset(parse_recipe_file(path))
+
+def get_translation_rules():
+    """(table, reference keys, digest of both files) for the current rule set."""
+    table = load_translation_table(RECIPE_TRANSLATION_TABLE, os.stat(RECIPE_TRANSLATION_TABLE).st_mtime_ns)
+    reference_keys = load_reference_keys(RECIPE_REFERENCE, os.stat(RECIPE_REFERENCE).st_mtime_ns)
+    digest = f"{file_sha256(RECIPE_TRANSLATION_TABLE)}|{file_sha256(RECIPE_REFERENCE)}"
+    return table, reference_keys, digest
+
+def translate_recipe_text(text, table, reference_keys, drop_unknown=False):
+    """
+    Applies the find/replace table line by line. Returns (translated text, report) where the
+    report lists translated lines, values of mapped keys the table doesn't cover, keys the
+    reference config doesn't know, and reference keys the profile lacks.
+    """
+    mapped_keys = {key for key, _ in table}
+    # A value that is already the Prusa side of a rule needs no translation
+    target_pairs = set(table.values())
+    report = {"translated": [], "unmapped": [], "unknown": [], "missing": []}
+    lines, seen = [], set()
+    for line in text.splitlines():
+        key, value = split_recipe_line(line)
+        if key is None:
+            lines.append(line)
+            continue
+        if (key, value) in table:
+            new_key, new_value = table[(key, value)]
+            report["translated"].append(f"{key} = {value} -> {new_key} = {new_value}")
+            key, line = new_key, f"{new_key} = {new_value}"
+        elif key in mapped_keys and (key, value) not in target_pairs:
+            report["unmapped"].append(f"{key} = {value}")
+        if reference_keys and key not in reference_keys:
+            report["unknown"].append(key)
+            if drop_unknown:
+                continue
+        seen.add(key)
+        lines.append(line)
+    report["missing"] = sorted(reference_keys - seen)
+    return "\n".join(lines) + "\n", report
+
+def translate_recipe_file(src_path, out_path, drop_unknown=False):
+    """Translates one profile into out_path, reusing a cached conversion when the source and rules are unchanged."""
+    table, reference_keys, rules_digest = get_translation_rules()
+    with open(src_path, "rb") as f:
+        source = f.read()
+    key = hashlib.sha256(source + f"|{rules_digest}|{drop_unknown}".encode("utf-8")).hexdigest()
+    cached_ini = os.path.join(TRANSLATION_CACHE_DIR, f"{key}.ini")
+    cached_report = os.path.join(TRANSLATION_CACHE_DIR, f"{key}.json")
+
+    try:
+        with open(cached_report, "r") as f:
+            report = json.load(f)
+        shutil.copyfile(cached_ini, out_path)
+        bump_cache_counter("translation_hits")
+        return report
+    except (OSError, ValueError):
+        pass
+
+    translated, report = translate_recipe_text(source.decode("utf-8", errors="replace"), table, reference_keys, drop_unknown)
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(translated)
+    bump_cache_counter("translation_misses")
+
+    try:
+        os.makedirs(TRANSLATION_CACHE_DIR, exist_ok=True)
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(out_path, cached_ini + tmp_suffix)
+        os.replace(cached_ini + tmp_suffix, cached_ini)
+        # Report written last: it is what marks an entry as complete
+        with open(cached_report + tmp_suffix, "w") as f:
+            json.dump(report, f)
+        os.replace(cached_report + tmp_suffix, cached_report)
+        bump_cache_counter("translation_evictions", evict_lru_files(TRANSLATION_CACHE_DIR, TRANSLATION_CACHE_MAX_BYTES))
+    except OSError:
+        pass
+    return report
+
+def translate_recipe_directory(src_dir, out_dir=RECIPE_DIR, drop_unknown=False, overwrite=False):
+    """Translates every .ini in src_dir into out_dir. Returns one summary row per profile."""
+    os.makedirs(out_dir, exist_ok=True)
+    rows = []
+    for filename in sorted(os.listdir(src_dir)):
+        if not filename.endswith(".ini"):
+            continue
+        out_path = os.path.join(out_dir, filename)
+        row = {"Profile": filename, "Status": "Translated", "Translated": 0, "Unmapped": "", "Unknown Keys": 0, "Missing Keys": 0}
+        if os.path.exists(out_path) and not overwrite:
+            row["Status"] = "Skipped (already exists)"
+            rows.append(row)
+            continue
+        try:
+            report = translate_recipe_file(os.path.join(src_dir, filename), out_path, drop_unknown)
+        except OSError as e:
+            row["Status"] = f"Failed: {e}"
+            rows.append(row)
+            continue
+
+        row.update({
+            "Translated": len(report["translated"]),
+            "Unmapped": ", ".join(report["unmapped"]),
+            "Unknown Keys": len(report["unknown"]),
+            "Missing Keys": len(report["missing"]),
+        })
+        if not parse_recipe_name(filename[:-len(".ini")]):
+            row["Status"] = "Translated (rename to '<Brand> <Model> <Material> <Nozzle>mm.ini')"
+        rows.append(row)
+    return rows
+
+
+# --- SLICE RESULT CACHE ---
+# G-code plus its parsed stats, keyed on everything that changes the slicer output:
+# STL content, compiled config (recipe + fleet overrides), brand/model post-processing
+# and slicer version.
+SLICE_CACHE_DIR = os.path.join(CACHE_ROOT, "slices")
+SLICE_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # LRU eviction above 2 GB
+SLICE_STATS_VERSION = 2  # Bump when parse_gcode_metadata's output changes
+
+def slice_cache_key(stl_path, config_digest, p_settings):
+    digest = hashlib.sha256(f"stats-v{SLICE_STATS_VERSION}".encode("utf-8"))
+    digest.update(file_sha256(stl_path).encode("utf-8"))
+    digest.update(config_digest.encode("utf-8"))
+    digest.update(f"{p_settings['brand']}|{p_settings['model']}".encode("utf-8"))
+    processors = matching_gcode_processors(p_settings['brand'], p_settings['model'])
+    digest.update(",".join(p["name"] for p in processors).encode("utf-8"))
+    try:
+        digest.update(slicer_appimage_version(os.path.abspath(SLICER_APPIMAGE)).encode("utf-8"))
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+def slice_cache_get(key, gcode_path):
+    """Copies cached G-code to gcode_path and returns its stats, or None on a miss."""
+    cached_gcode = os.path.join(SLICE_CACHE_DIR, f"{key}.gcode")
+    cached_stats = os.path.join(SLICE_CACHE_DIR, f"{key}.json")
+    try:
+        with open(cached_stats, "r") as f:
+            stats = json.load(f)
+        shutil.copyfile(cached_gcode, gcode_path)
+        os.utime(cached_gcode)  # Mark as recently used for LRU eviction
+        os.utime(cached_stats)
+    except (OSError, ValueError):
+        bump_cache_counter("slice_misses")
+        return None
+
+    # The finish time depends on when the user slices, not when it was cached
+    if stats.get("time") and stats["time"] != "Unknown":
+        stats["finish_time"] = estimate_finish_time(stats["time"])
+    bump_cache_counter("slice_hits")
+    return stats
+
+def slice_cache_put(key, gcode_path, stats):
+    try:
+        os.makedirs(SLICE_CACHE_DIR, exist_ok=True)
+        cached_gcode = os.path.join(SLICE_CACHE_DIR, f"{key}.gcode")
+        cached_stats = os.path.join(SLICE_CACHE_DIR, f"{key}.json")
+        tmp_suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(gcode_path, cached_gcode + tmp_suffix)
+        os.replace(cached_gcode + tmp_suffix, cached_gcode)
+        # Stats are written last: the .json is what marks an entry as complete
+        with open(cached_stats + tmp_suffix, "w") as f:
+            json.dump(stats, f)
+        os.replace(cached_stats + tmp_suffix, cached_stats)
+        bump_cache_counter("slice_evictions", evict_lru_files(SLICE_CACHE_DIR, SLICE_CACHE_MAX_BYTES))
+    except OSError:
+        pass # A cache write failure should never fail the slice itself
+
+
+# --- FLEET FAN-OUT SLICING ---
+# Slices one STL for every compatible printer in the fleet at the same time. The whole
+# fan-out is a single job on the slice queue; its per-printer slices run on their own pool,
+# but every slicer process still takes a slot from get_slicer_slots().
+#
+#   NAPKIN_SLICE_WORKERS        slice jobs (single part or whole fleet) running at once
+#   NAPKIN_FLEET_SLICE_WORKERS  printers one fleet job slices in parallel
+#   NAPKIN_SLICER_PROCESSES     slicer processes alive at once across all jobs; defaults to
+#                               the larger of the two above so a fleet job really runs in parallel
+FLEET_SLICE_WORKERS = int(os.environ.get("NAPKIN_FLEET_SLICE_WORKERS", 4))
+SLICER_PROCESS_LIMIT = int(os.environ.get("NAPKIN_SLICER_PROCESSES", 0))
+
+@st.cache_resource
+def get_fleet_slice_executor():
+    return ThreadPoolExecutor(max_workers=FLEET_SLICE_WORKERS, thread_name_prefix="napkin-fleet")
+
+def fleet_gcode_filename(index, nickname):
+    # The index keeps nicknames that slug the same ("Ender #1" / "Ender 1") from sharing a file
+    slug = re.sub(r"[^A-Za-z0-9_-]+", "_", str(nickname)).strip("_") or "printer"
+    return f"{index:02d}_{slug}_part.gcode"
+
+def build_fleet_targets(fleet_df, part_size=None):
+    """
+    Splits the fleet into printers that can take the part and printers that can't
+    (no verified recipe, or the part doesn't fit the bed when part_size is known).
+    Targets are (nickname, machine label, recipe name, overrides, p_settings) tuples;
+    skipped entries are (nickname, reason).
+    """
+    targets, skipped = [], []
+    for _, p_settings in fleet_df.iterrows():
+        nickname = p_settings['printer nickname']
+        hardware_name, overrides = printer_slice_settings(p_settings)
+        recipe = get_recipe(hardware_name)
+        if recipe is None:
+            skipped.append((nickname, "no verified recipe"))
+            continue
+        if part_size:
+            fits, reason = part_fits_recipe(part_size, recipe)
+            if not fits:
+                skipped.append((nickname, reason))
+                continue
+        machine = f"{p_settings['brand']} {p_settings['model']} ({p_settings['material']})"
+        targets.append((nickname, machine, hardware_name, overrides, p_settings))
+    return targets, skipped
+
+def slice_fleet(stl_path, work_dir, targets, control=None):
+    """Slices stl_path for every target concurrently. Returns one result row per target, in order."""
+    executor = get_fleet_slice_executor()
+    ctx = get_script_run_ctx()
+
+    def slice_one(gcode_path, hardware_name, overrides, p_settings):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return run_slicing_workflow(stl_path, gcode_path, hardware_name, overrides, p_settings, control)
+
+    futures = []
+    for i, (nickname, _, hardware_name, overrides, p_settings) in enumerate(targets):
+        gcode_path = os.path.join(work_dir, fleet_gcode_filename(i, nickname))
+        futures.append((gcode_path, executor.submit(slice_one, gcode_path, hardware_name, overrides, p_settings)))
+
+    results = []
+    for (nickname, machine, _, _, _), (gcode_path, future) in zip(targets, futures):
+        try:
+            success, result = future.result()
+        except Exception as e:
+            success, result = False, f"System Error: {e}"
+        results.append({"printer": nickname, "machine": machine, "gcode_path": gcode_path, "success": success, "result": result})
+    return results
+
+def fleet_comparison_table(results):
+    """Comparison rows for the fleet results, fastest successful printer first."""
+    rows = []
+    for r in results:
+        stats = r["result"] if r["success"] else {}
+        rows.append({
+            "Printer": r["printer"],
+            "Machine": r["machine"],
+            "Est. Time": stats.get("time", "-"),
+            "Est. Finish": stats.get("finish_time", "-"),
+            "Filament (g)": stats.get("filament_g"),
+            "Cost": stats.get("filament_cost"),
+            "Layers": stats.get("layer_count"),
+            "Status": "OK" if r["success"] else f"Failed: {r['result']}",
+            "_seconds": stats.get("time_seconds"),
+        })
+    df = pd.DataFrame(rows)
+    df = df.sort_values("_seconds", na_position="last", kind="stable")
+    return df.drop(columns="_seconds")
+
+
+# --- G-CODE ANALYZER ---
+# Independent of the slicer footer: moves are tokenized straight from the raw bytes with
+# NumPy, a few MB at a time, and timed with a trapezoidal speed profile using the recipe's
+# machine limits. Good enough to chart per-layer time and sanity-check the slicer's estimate.
+GCODE_ANALYZE_CHUNK = 8 * 1024 * 1024
+GCODE_AXES = b"XYZEF"
+GCODE_NUMBER_WIDTH = 16  # Longest number token parsed; G-code coordinates are far shorter
+GCODE_AXIS_INDEX = np.full(256, -1, dtype=np.int8)
+GCODE_AXIS_INDEX[np.frombuffer(GCODE_AXES, dtype=np.uint8)] = np.arange(len(GCODE_AXES))
+GCODE_DELIMITERS = np.zeros(256, dtype=bool)
+GCODE_DELIMITERS[np.frombuffer(b" \t\r\n;", dtype=np.uint8)] = True
+GCODE_LIMIT_DEFAULTS = {
+    "machine_max_feedrate_x": 500, "machine_max_feedrate_y": 500,
+    "machine_max_feedrate_z": 12, "machine_max_feedrate_e": 120,
+    "machine_max_acceleration_x": 1000, "machine_max_acceleration_y": 1000,
+    "machine_max_acceleration_z": 200, "machine_max_acceleration_e": 5000,
+    "machine_max_acceleration_extruding": 1000, "machine_max_acceleration_travel": 1000,
+    "machine_max_acceleration_retracting": 1000,
+    "machine_max_jerk_x": 8, "machine_max_jerk_y": 8,
+    "filament_diameter": 1.75,
+}
+
+def gcode_limit(config, key):
+    """First value of a (possibly normal,silent) config entry, or the default."""
+    try:
+        value = float(str(config.get(key, "")).split(",")[0])
+        return value if value > 0 else GCODE_LIMIT_DEFAULTS[key]
+    except ValueError:
+        return GCODE_LIMIT_DEFAULTS[key]
+
+def forward_fill(values, start=0.0):
+    """NumPy forward fill of NaNs; leading NaNs become start."""
+    idx = np.where(np.isnan(values), 0, np.arange(len(values)))
+    np.maximum.accumulate(idx, out=idx)
+    filled = values[idx]
+    filled[np.isnan(filled)] = start
+    return filled
+
+def parse_gcode_block(block):
+    """
+    Vectorized tokenizer for a block of whole G-code lines.
+    Returns (is_reset, values) where values has one X/Y/Z/E/F row per G0/G1/G92 line, NaN where absent.
+    """
+    buf = np.frombuffer(block + b"\n\0\0\0", dtype=np.uint8)
+    newlines = np.flatnonzero(buf[:len(block) + 1] == 10)
+    starts = np.concatenate(([0], newlines[:-1] + 1))
+
+    c0, c1, c2, c3 = buf[starts], buf[starts + 1], buf[starts + 2], buf[starts + 3]
+    is_move = (c0 == ord("G")) & ((c1 == ord("0")) | (c1 == ord("1"))) & GCODE_DELIMITERS[c2]
+    is_g92 = (c0 == ord("G")) & (c1 == ord("9")) & (c2 == ord("2")) & GCODE_DELIMITERS[c3]
+    keep = is_move | is_g92
+    rows = np.full(len(starts), -1)
+    rows[keep] = np.arange(np.count_nonzero(keep))
+    values = np.full((np.count_nonzero(keep), len(GCODE_AXES)), np.nan)
+
+    # Words are an axis letter right after a space, before any ';' comment on the line
+    words = np.flatnonzero((GCODE_AXIS_INDEX[buf[1:]] >= 0) & (buf[:-1] == 32)) + 1
+    line = np.searchsorted(starts, words, side="right") - 1
+    semis = np.flatnonzero(buf == ord(";"))
+    semi_line = np.searchsorted(starts, semis, side="right") - 1
+    first_semi = np.full(len(starts), len(buf))
+    uniq_lines, first_idx = np.unique(semi_line, return_index=True)
+    first_semi[uniq_lines] = semis[first_idx]
+    ok = (rows[line] >= 0) & (words < first_semi[line])
+    words, line = words[ok], line[ok]
+
+    # Numbers are read one character column at a time (Horner's rule) across all words at once
+    delims = np.flatnonzero(GCODE_DELIMITERS[buf])
+    ends = delims[np.searchsorted(delims, words + 1)]
+    lengths = ends - words - 1
+    mantissa = np.zeros(len(words))
+    decimals = np.zeros(len(words), dtype=np.int64)
+    seen_dot = np.zeros(len(words), dtype=bool)
+    seen_digit = np.zeros(len(words), dtype=bool)
+    for col in range(min(int(lengths.max(initial=0)), GCODE_NUMBER_WIDTH)):
+        chars = np.where(col < lengths, buf[words + 1 + col], 0)
+        digit = (chars >= ord("0")) & (chars <= ord("9"))
+        mantissa = np.where(digit, mantissa * 10 + (chars - ord("0")), mantissa)
+        decimals += digit & seen_dot
+        seen_dot |= chars == ord(".")
+        seen_digit |= digit
+    number = mantissa / 10.0 ** decimals
+    number[buf[words + 1] == ord("-")] *= -1
+    number[~seen_digit] = np.nan
+
+    values[rows[line], GCODE_AXIS_INDEX[buf[words]]] = number
+    return is_g92[keep], values
+
+def tokenize_gcode_moves(gcode_path):
+    """Returns (is_reset, x, y, z, e, f) arrays for every G0/G1/G92 line, NaN where a word is absent."""
+    resets, blocks = [], []
+    with open(gcode_path, "rb") as f:
+        carry = b""
+        while True:
+            block = carry + f.read(GCODE_ANALYZE_CHUNK)
+            if not block:
+                break
+            cut = block.rfind(b"\n") + 1
+            if cut == 0 or len(block) < GCODE_ANALYZE_CHUNK:
+                cut = len(block)  # Last block
+            block, carry = block[:cut], block[cut:]
+            is_reset, values = parse_gcode_block(block)
+            resets.append(is_reset)
+            blocks.append(values)
+    if not blocks:
+        return [np.zeros(0, dtype=bool)] + [np.zeros(0) for _ in GCODE_AXES]
+    values = np.concatenate(blocks)
+    return [np.concatenate(resets)] + [values[:, i].copy() for i in range(len(GCODE_AXES))]
+
+def analyze_gcode(gcode_path, config=None):
+    """
+    Per-layer print time, extrusion and travel for a G-code file.
+    Returns a dict of totals plus a "layers" DataFrame (one row per extruding Z height).
+    """
+    config = config or {}
+    is_reset, x, y, z, e, f = tokenize_gcode_moves(gcode_path)
+
+    with open(gcode_path, "rb") as fh:
+        head = fh.read(64 * 1024)
+    relative_e = str(config.get("use_relative_e_distances", "")) == "1" or re.search(rb"^M83", head, re.MULTILINE) is not None
+
+    # G92 only resets E; its X/Y/Z/F words (rare) are ignored for motion
+    for axis in (x, y, z, f):
+        axis[is_reset] = np.nan
+    x, y, z = forward_fill(x), forward_fill(y), forward_fill(z)
+    feed = forward_fill(f, start=1800.0) / 60.0  # mm/min -> mm/s
+
+    if relative_e:
+        de = np.nan_to_num(e)
+        de[is_reset] = 0.0
+    else:
+        e_pos = forward_fill(e)
+        de = np.diff(e_pos, prepend=0.0)
+        de[is_reset] = 0.0
+
+    dx, dy, dz = np.diff(x, prepend=x[:1]), np.diff(y, prepend=y[:1]), np.diff(z, prepend=z[:1])
+    xyz = np.sqrt(dx * dx + dy * dy + dz * dz)
+    pure_e = (xyz == 0) & (de != 0)
+    dist = np.where(pure_e, np.abs(de), xyz)
+    extruding = (xyz > 0) & (de > 0)
+
+    # Unit direction per move, used to clamp speed/acceleration by the per-axis limits
+    with np.errstate(divide="ignore", invalid="ignore"):
+        safe = np.where(dist > 0, dist, 1.0)
+        unit = {"x": np.abs(dx) / safe, "y": np.abs(dy) / safe, "z": np.abs(dz) / safe, "e": np.where(pure_e, 1.0, 0.0)}
+
+        v_max = feed.copy()
+        a_max = np.where(pure_e, gcode_limit(config, "machine_max_acceleration_retracting"),
+                         np.where(de > 0, gcode_limit(config, "machine_max_acceleration_extruding"),
+                                  gcode_limit(config, "machine_max_acceleration_travel")))
+        for axis, comp in unit.items():
+            v_max = np.minimum(v_max, np.where(comp > 0, gcode_limit(config, f"machine_max_feedrate_{axis}") / comp, np.inf))
+            a_max = np.minimum(a_max, np.where(comp > 0, gcode_limit(config, f"machine_max_acceleration_{axis}") / comp, np.inf))
+
+        # Trapezoid from/to the jerk speed; short moves never reach cruise speed
+        v0 = np.minimum(v_max, min(gcode_limit(config, "machine_max_jerk_x"), gcode_limit(config, "machine_max_jerk_y")))
+        ramp = (v_max * v_max - v0 * v0) / a_max
+        cruise_t = dist / v_max + (v_max - v0) ** 2 / (a_max * v_max)
+        short_t = 2.0 * (np.sqrt(v0 * v0 + a_max * dist) - v0) / a_max
+        move_t = np.where(dist >= ramp, cruise_t, short_t)
+    move_t = np.where(dist > 0, move_t, 0.0)
+
+    layer_zs = np.unique(z[extruding])
+    if len(layer_zs) == 0:
+        layer_zs = np.zeros(1)
+    # Travel and z-hops belong to the layer of the last extruding move, not to their own Z
+    layer_z = forward_fill(np.where(extruding, z, np.nan), start=layer_zs[0])
+    layer = np.clip(np.searchsorted(layer_zs, layer_z, side="right") - 1, 0, None)
+    n = len(layer_zs)
+
+    filament_area = math.pi * (gcode_limit(config, "filament_diameter") / 2) ** 2
+    extruded = np.where(de > 0, de, 0.0)
+    travel = np.where(extruding | pure_e, 0.0, xyz)
+    layers = pd.DataFrame({
+        "Layer": np.arange(1, n + 1),
+        "Z (mm)": layer_zs,
+        "Time (s)": np.bincount(layer, weights=move_t, minlength=n),
+        "Filament (mm)": np.bincount(layer, weights=extruded, minlength=n),
+        "Travel (mm)": np.bincount(layer, weights=travel, minlength=n),
+    })
+    layers["Volume (mm3)"] = layers["Filament (mm)"] * filament_area
+
+    return {
+        "moves": int(len(dist)),
+        "time_seconds": float(move_t.sum()),
+        "filament_mm": float(extruded.sum()),
+        "volume_mm3": float(extruded.sum() * filament_area),
+        "travel_mm": float(travel.sum()),
+        "layer_count": int(n),
+        "layers": layers,
+    }
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def get_gcode_analysis(gcode_path, mtime_ns, config):
+    """Cached analyze_gcode; mtime_ns is only part of the cache key so a re-slice re-analyzes."""
+    return analyze_gcode(gcode_path, config)
+
+def show_gcode_analysis(gcode_path, config=None, slicer_seconds=None):
+    """
+    Layer-time chart plus totals, compared against the slicer's own estimate when known.
+    A big file takes seconds to analyze, so nothing runs until the user asks for it.
+    """
+    mtime_ns = os.stat(gcode_path).st_mtime_ns
+    if st.session_state.get("gcode_analysis_for") != (gcode_path, mtime_ns):
+        if not st.button("Analyze Layers", key="analyze_gcode", use_container_width=True):
+            st.caption("Times every move in the G-code to chart per-layer print time.")
+            return
+        st.session_state.gcode_analysis_for = (gcode_path, mtime_ns)
+
+    with st.spinner("Analyzing G-code..."):
+        analysis = get_gcode_analysis(gcode_path, mtime_ns, config or {})
+    a1, a2, a3 = st.columns(3)
+    estimate = str(timedelta(seconds=int(analysis["time_seconds"])))
+    if slicer_seconds:
+        drift = (analysis["time_seconds"] - slicer_seconds) / slicer_seconds * 100
+        a1.metric("Analyzer Time", estimate, f"{drift:+.0f}% vs slicer", delta_color="off")
+    else:
+        a1.metric("Analyzer Time", estimate)
+    a2.metric("Layers", analysis["layer_count"])
+    a3.metric("Travel", f"{analysis['travel_mm'] / 1000:.1f} m")
+    st.caption(f"{analysis['moves']} moves | {analysis['filament_mm'] / 1000:.2f} m filament | {analysis['volume_mm3'] / 1000:.1f} cm3")
+    st.bar_chart(analysis["layers"], x="Layer", y="Time (s)")
+
+
+# --- RENDER / SLICE WORKER POOLS ---
+# OpenSCAD and the slicer run on bounded, process-wide worker pools instead of the
+# Streamlit script thread. Each worker just waits on its subprocess, so the pool size
+# is the number of renders/slices allowed to run on this box at the same time.
+STAGE_WORKERS = {
+    "render": int(os.environ.get("NAPKIN_RENDER_WORKERS", 2)),
+    "slice": int(os.environ.get("NAPKIN_SLICE_WORKERS", 1)),
+}
+STAGE_QUEUE_LIMITS = {
+    "render": int(os.environ.get("NAPKIN_RENDER_QUEUE", 8)),
+    "slice": int(os.environ.get("NAPKIN_SLICE_QUEUE", 4)),
+}
+STAGE_LABELS = {"render": "Render", "slice": "Slice"}
+
+@st.cache_resource
+def get_stage_pool(stage):
+    return {
+        "executor": ThreadPoolExecutor(max_workers=STAGE_WORKERS[stage], thread_name_prefix=f"napkin-{stage}"),
+        "lock": threading.Lock(),
+        "waiting": [],         # Job ids in submission order, not yet picked up by a worker
+        "avg_seconds": 30.0,   # Rolling average job duration, used for the retry estimate
+    }
+
+def submit_stage_job(stage, fn, *args):
+    """
+    Queues fn(*args) on a stage's worker pool.
+    Returns a job dict, or None when the queue is full and the caller should back off.
+    """
+    pool = get_stage_pool(stage)
+    job = {"id": uuid.uuid4().hex, "stage": stage, "submitted": time.time(), "started": None, "future": None}
+
+    with pool["lock"]:
+        if len(pool["waiting"]) >= STAGE_QUEUE_LIMITS[stage]:
+            bump_cache_counter(f"{stage}_rejected")
+            return None
+        pool["waiting"].append(job["id"])
+
+    ctx = get_script_run_ctx()
+
+    def run():
+        # Lets the worker use st.cache_resource without "missing ScriptRunContext" warnings
+        add_script_run_ctx(threading.current_thread(), ctx)
+        # Leave the line and mark the start together, so the status panel never sees
+        # a job that is out of the queue but has no start time yet
+        with pool["lock"]:
+            pool["waiting"].remove(job["id"])
+            job["started"] = time.time()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.time() - job["started"]
+            with pool["lock"]:
+                pool["avg_seconds"] = 0.8 * pool["avg_seconds"] + 0.2 * elapsed
+
+    job["future"] = pool["executor"].submit(run)
+    return job
+
+def job_queue_position(job):
+    """1-based position in the stage queue, or 0 once a worker has started the job."""
+    pool = get_stage_pool(job["stage"])
+    with pool["lock"]:
+        if job["id"] in pool["waiting"]:
+            return pool["waiting"].index(job["id"]) + 1
+    return 0
+
+def cancel_stage_job(job):
+    """Drops a queued job from the line, or stops a running slice through its control. Frees the slot right away."""
+    if job["future"].cancel():
+        pool = get_stage_pool(job["stage"])
+        with pool["lock"]:
+            if job["id"] in pool["waiting"]:
+                pool["waiting"].remove(job["id"])
+    if job.get("control") is not None:
+        cancel_slice(job["control"])
+
+def queue_full_message(stage):
+    pool = get_stage_pool(stage)
+    # Rough wait until one queued job clears a worker
+    retry_in = int(pool["avg_seconds"] * STAGE_QUEUE_LIMITS[stage] / max(1, STAGE_WORKERS[stage]))
+    return f"Server busy: the {STAGE_LABELS[stage].lower()} queue is full. Please try again in about {max(5, retry_in)} seconds."
+
+@st.fragment(run_every=1)
+def job_status_panel(job_key):
+    """Polls a queued job without blocking the rest of the page, then reruns the app once it finishes."""
+    job = st.session_state.get(job_key)
+    if not job:
+        return
+    if job["future"].done():
+        st.rerun()
+
+    label = STAGE_LABELS[job["stage"]]
+    control = job.get("control")
+    position = job_queue_position(job)
+    if position:
+        st.info(f"{label} queued: position {position} in line.")
+    elif control is not None:
+        percent, stage = slice_progress(control)
+        st.progress(percent, text=f"{label}: {stage} ({int(time.time() - job['started'])}s)")
+    else:
+        st.info(f"{label} in progress... ({int(time.time() - job['started'])}s)")
+
+    if control is not None and st.button(f"Cancel {label}", key=f"cancel_{job_key}", use_container_width=True):
+        cancel_stage_job(job)
+        st.rerun()
+
+
+# --- GEMINI GENERATION ---
+GEMINI_MODEL = "gemini-2.0-flash"
+STREAM_GENERATION = os.environ.get("NAPKIN_STREAM_GENERATION", "1") != "0"
+SCAD_BLOCK_RE = re.compile(r"```openscad(.*?)```", re.DOTALL)
+
+def extract_decoded_logic(text):
+    """Text after '[DECODED LOGIC]:' up to the next tag. Works on a partial response too."""
+    if "[DECODED LOGIC]:" not in text:
+        return ""
+    return text.split("[DECODED LOGIC]:", 1)[1].split("[", 1)[0].strip()
+
+def generate_scad(client, contents, on_logic=None, stream=STREAM_GENERATION):
+    """
+    Asks Gemini for OpenSCAD code and returns (code, logic). code is None if no openscad block came back.
+
+    In streaming mode the response is read chunk by chunk, on_logic(text) is called as the
+    [DECODED LOGIC] grows, and reading stops as soon as the closing code fence arrives.
+    Only client.models.generate_content(_stream) is used, so a local fake client works for testing.
+    """
+    if not stream:
+        text = client.models.generate_content(model=GEMINI_MODEL, contents=contents).text or ""
+        scad_match = SCAD_BLOCK_RE.search(text)
+    else:
+        text = ""
+        shown_logic = ""
+        scad_match = None
+        for chunk in client.models.generate_content_stream(model=GEMINI_MODEL, contents=contents):
+            text += chunk.text or ""
+
+            logic_so_far = extract_decoded_logic(text)
+            if on_logic and logic_so_far != shown_logic:
+                shown_logic = logic_so_far
+                on_logic(logic_so_far)
+
+            # Stop as soon as the code block is closed; anything after it isn't used
+            scad_match = SCAD_BLOCK_RE.search(text)
+            if scad_match:
+                break
+
+    if not scad_match:
+        return None, extract_decoded_logic(text)
+    return scad_match.group(1).strip(), extract_decoded_logic(text) or "Standard generation"
+
+
+# --- PARALLEL CANDIDATES & REPAIR LOOP ---
+# Fires several generations at once, renders each through the shared render pool and keeps
+# the first one that renders cleanly. Failed renders are sent back to the model with the
+# OpenSCAD error output for a bounded number of repair attempts.
+MAX_CANDIDATES = 4
+REPAIR_ATTEMPTS = 2
+# A full render queue says nothing about the code, so it is retried with backoff
+# (1s, 2s, 4s, 8s) instead of being sent to the model as a render error
+RENDER_QUEUE_FULL = "Render queue is full."
+RENDER_BUSY_RETRIES = 4
+RENDER_BUSY_WAIT = 1.0
+
+@st.cache_resource
+def get_candidate_executor():
+    return ThreadPoolExecutor(max_workers=MAX_CANDIDATES * 4, thread_name_prefix="napkin-candidate")
+
+def pooled_render(exe, scad_code, scad_path, stl_path, draft=DRAFT_PREVIEW):
+    """Renders through the render stage pool and waits for the result."""
+    job = submit_stage_job("render", render_scad_to_stl, exe, scad_code, scad_path, stl_path, draft)
+    if job is None:
+        return False, RENDER_QUEUE_FULL, False
+    return job["future"].result()
+
+def repair_contents(contents, failed_code, error_log):
+    return list(contents) + [
+        "Your previous answer failed to render in OpenSCAD.\n"
+        f"FAILED CODE:\n```openscad\n{failed_code}\n```\n"
+        f"OPENSCAD ERROR OUTPUT:\n{str(error_log)[-2000:]}\n"
+        "Fix the error and answer again in the same format."
+    ]
+
+def run_candidate(client, contents, render_fn, work_dir, stop_event, max_repairs):
+    attempt_contents = contents
+    result = {"code": None, "logic": "", "error": "", "attempts": 0}
+
+    for attempt in range(max_repairs + 1):
+        if stop_event.is_set():
+            break
+        result["attempts"] = attempt + 1
+        code, logic = generate_scad(client, attempt_contents, stream=False)
+        result["logic"] = logic
+        if not code:
+            result["error"] = "AI failed to return valid code."
+            attempt_contents = list(contents) + ["Your previous answer had no ```openscad code block. Answer again in the exact format."]
+            continue
+        if stop_event.is_set():
+            break
+
+        scad_path = os.path.join(work_dir, f"attempt_{attempt}.scad")
+        stl_path = os.path.join(work_dir, f"attempt_{attempt}.stl")
+        busy_waits = 0
+        while True:
+            rendered, render_log, _ = render_fn(code, scad_path, stl_path)
+            if render_log != RENDER_QUEUE_FULL or busy_waits >= RENDER_BUSY_RETRIES:
+                break
+            if stop_event.wait(RENDER_BUSY_WAIT * 2 ** busy_waits):
+                break
+            busy_waits += 1
+
+        if rendered:
+            result["code"] = code
+            return result
+        result["error"] = render_log
+        if render_log == RENDER_QUEUE_FULL:
+            # Still busy (or stopped): end this candidate without spending a repair call
+            break
+        attempt_contents = repair_contents(contents, code, render_log)
+    return result
+
+def generate_with_candidates(client, contents, render_fn, work_dir, count, max_repairs=REPAIR_ATTEMPTS):
+    """
+    Races `count` candidate generations and returns the first result dict whose code rendered.
+    If every candidate fails, returns the last failure (code is None, error holds the log).
+    render_fn(scad_code, scad_path, stl_path) -> (success, log, cache_hit), so a stubbed
+    client and renderer can be used to benchmark the loop.
+    """
+    stop_event = threading.Event()
+    ctx = get_script_run_ctx()
+
+    def run(i):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        candidate_dir = os.path.join(work_dir, f"candidate_{i}")
+        os.makedirs(candidate_dir, exist_ok=True)
+        return run_candidate(client, contents, render_fn, candidate_dir, stop_event, max_repairs)
+
+    futures = [get_candidate_executor().submit(run, i) for i in range(min(count, MAX_CANDIDATES))]
+    last_failure = {"code": None, "logic": "", "error": "No candidate rendered.", "attempts": 0}
+    try:
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                last_failure = {"code": None, "logic": "", "error": str(e), "attempts": 0}
+                continue
+            if result["code"]:
+                return result
+            last_failure = result
+    finally:
+        # Losing candidates stop before their next model call or render
+        stop_event.set()
+    return last_failure
+
+
+def queue_final_render():
+    """
+    Queues the full-resolution render for the current generation, unless one is already
+    running or has succeeded. Returns the job, or None if the render queue is full.
+    """
+    job = st.session_state.get("final_job")
+    if job and (not job["future"].done() or job["future"].exception() is None and job["future"].result()[0]):
+        return job
+
+    gen_dir = st.session_state.get("generation_dir")
+    job = submit_stage_job(
+        "render", render_scad_to_stl, shutil.which("openscad"), st.session_state.last_code,
+        os.path.join(gen_dir, "part.scad"), os.path.join(gen_dir, "part.stl")
+    )
+    if job is None:
+        st.warning(queue_full_message("render"))
+    st.session_state.final_job = job
+    return job
+
+
 # --- CUSTOM CSS (Button logic unchanged, Footer fixed) ---
 st.markdown(f"""
     <style>
@@ -759,29 +3369,26 @@ elif st.session_state.page == "Make a Part":
     # --- REPLACED DRIVE UPLOAD WITH BASE64 LOGIC ---
     def log_feedback_to_sheets(category):
         try:
-            existing_data = conn.read(worksheet="Pending", ttl=0)
-            
-            img_str = ""
-            # Convert image to string if it exists, otherwise leave blank
+            img_ref = ""
+            # The thumbnail goes to the blob store and the sheet gets its hash (or base64 if there's no durable store)
             if "current_img" in st.session_state and st.session_state.current_img is not None:
                 buffered = BytesIO()
                 img = st.session_state.current_img.copy()
                 img.thumbnail((400, 400)) 
-                img.save(buffered, format="JPEG", quality=60)
-                img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
+                img.convert("RGB").save(buffered, format="JPEG", quality=60)
+                img_ref = store_blob(buffered.getvalue())
 
-            new_row = pd.DataFrame([{
+            new_row = {
                 "Status": category,
                 "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                 "User_Email": st.session_state.get('user_email', 'Guest'), 
                 "Prompt": st.session_state.get('last_prompt', ""),
                 "Logic": st.session_state.get('last_logic', ""),
                 "Code": st.session_state.get('last_code', "").replace("\n", " [NEWLINE] "),
-                "Image_File": img_str 
-            }])
+                "Image_File": img_ref
+            }
             
-            updated_df = pd.concat([existing_data, new_row], ignore_index=True)
-            conn.update(worksheet="Pending", data=updated_df)
+            queue_sheet_op("Pending", {"kind": "append", "rows": [new_row]})
             
             if st.session_state.get('authenticated'):
                 increment_models_generated(st.session_state.user_email)
@@ -811,6 +3418,11 @@ elif st.session_state.page == "Make a Part":
             st.session_state.current_img = None
 
         user_context = st.text_area("Specifications", placeholder="e.g. A 50x50mm cube...", height=150)
+        regenerate = st.checkbox("Regenerate anyway", help="Ignore any saved result for an identical request and ask the AI again.")
+        candidate_count = st.select_slider(
+            "Parallel candidates", options=list(range(1, MAX_CANDIDATES + 1)), value=1,
+            help="Generate several designs at once and keep the first one that renders. Failed renders are sent back to the AI for repair."
+        )
         generate_btn = st.button("Generate 3D Model", type="primary", use_container_width=True)
 
     with col2:
@@ -826,24 +3438,8 @@ elif st.session_state.page == "Make a Part":
                         if not exe:
                             st.error("Engine Error: OpenSCAD not found on server.")
                         else:
-                            client = genai.Client(api_key=st.secrets["GEMINI_KEY"])
-                            library_context = ""
-                            if os.path.exists("libraries"):
-                                for fn in os.listdir("libraries"):
-                                    if fn.endswith(".scad"):
-                                        with open(os.path.join("libraries", fn), "r") as f:
-                                            library_context += f"\n--- LIBRARY: {fn} ---\n{f.read()}\n"
-                            
-                            training_context = ""
-                            try:
-                                training_df = conn.read(worksheet="Corrected", ttl=0)
-                                if not training_df.empty:
-                                    training_context = "\n--- GOLD STANDARD EXAMPLES ---\n"
-                                    for _, row in training_df.iterrows():
-                                        clean_code = str(row['Code']).replace(" [NEWLINE] ", "\n")
-                                        training_context += f"/* PROMPT: {row['Prompt']} \n LOGIC: {row['Logic']} \n CODE: \n {clean_code} */\n\n"
-                            except:
-                                training_context = ""
+                            library_context = get_library_context()
+                            training_context = get_training_context(user_context)
 
                             type_instruction = "The provided image is a 2D profile." if upload_choice == "Sketch + Description" and sketch_type == "2D (Multiple Views)" else "The provided image is a 3D sketch."
                             
@@ -861,49 +3457,148 @@ elif st.session_state.page == "Make a Part":
                             )
                             
                             inputs = [prompt, st.session_state.current_img] if upload_choice == "Sketch + Description" else [prompt]
-                            response = client.models.generate_content(model="gemini-2.0-flash", contents=inputs)
+                            sketch_label = sketch_type if upload_choice == "Sketch + Description" else "Text Only"
+                            cache_key = generation_cache_key(user_context, sketch_label, st.session_state.current_img)
+                            cached = None if regenerate else generation_cache_get(cache_key)
+                            render_busy = False
                             
-                            scad_match = re.search(r"```openscad(.*?)```", response.text, re.DOTALL)
-                            logic_match = re.search(r"\[DECODED LOGIC\]:(.*?)\[", response.text, re.DOTALL)
-                            
-                            if scad_match:
-                                st.session_state.last_code = scad_match.group(1).strip()
-                                st.session_state.last_logic = logic_match.group(1).strip() if logic_match else "Standard generation"
-                                st.session_state.last_prompt = user_context
-                                with open("part.scad", "w") as f: f.write(st.session_state.last_code)
-                                
-                                my_env = os.environ.copy()
-                                my_env["OPENSCADPATH"] = os.path.join(os.getcwd(), "libraries")
-                                result = subprocess.run([exe, "-o", "part.stl", "part.scad"], env=my_env, capture_output=True, text=True)
-                                
-                                if result.returncode != 0:
-                                    st.error("Render Failed")
+                            if cached:
+                                scad_code, decoded_logic = cached
+                                st.caption("Loaded from generation cache. Tick 'Regenerate anyway' for a fresh design.")
+                            elif candidate_count > 1:
+                                client = genai.Client(api_key=st.secrets["GEMINI_KEY"])
+                                candidate_dir = tempfile.mkdtemp(prefix="candidates_", dir=get_session_workspace())
+                                winner = generate_with_candidates(
+                                    client, inputs,
+                                    lambda code, scad_path, stl_path: pooled_render(exe, code, scad_path, stl_path),
+                                    candidate_dir, candidate_count
+                                )
+                                scad_code, decoded_logic = winner["code"], winner["logic"]
+                                if scad_code:
+                                    st.caption(f"Best of {candidate_count} candidates rendered after {winner['attempts']} attempt(s).")
+                                    generation_cache_put(cache_key, scad_code, decoded_logic)
+                                elif winner["error"] == RENDER_QUEUE_FULL:
+                                    render_busy = True
+                                    st.warning(queue_full_message("render"))
                                 else:
-                                    stl_from_file("part.stl", color='#58a6ff')
+                                    with st.expander("Show Technical Error Logs"):
+                                        st.code(winner["error"])
                             else:
+                                client = genai.Client(api_key=st.secrets["GEMINI_KEY"])
+                                logic_box = st.empty()
+                                scad_code, decoded_logic = generate_scad(
+                                    client, inputs,
+                                    on_logic=lambda text: logic_box.markdown(f"**[DECODED LOGIC]:** {text}")
+                                )
+                                if scad_code:
+                                    generation_cache_put(cache_key, scad_code, decoded_logic)
+                            
+                            if scad_code:
+                                st.session_state.last_code = scad_code
+                                st.session_state.last_logic = decoded_logic
+                                st.session_state.last_prompt = user_context
+                                gen_dir = new_generation_workspace()
+                                # Slices of the previous part are abandoned, so stop them using capacity
+                                for old_key in ("slice_job", "fleet_job"):
+                                    if st.session_state.get(old_key):
+                                        cancel_stage_job(st.session_state[old_key])
+                                st.session_state.slice_job = None
+                                st.session_state.fleet_job = None
+                                st.session_state.pending_slice = None
+                                st.session_state.render_job = submit_stage_job(
+                                    "render", render_scad_to_stl, exe, st.session_state.last_code,
+                                    os.path.join(gen_dir, "part_draft.scad" if DRAFT_PREVIEW else "part.scad"),
+                                    os.path.join(gen_dir, PREVIEW_STL), DRAFT_PREVIEW
+                                )
+                                # Without draft mode the preview render already is the full-resolution one
+                                st.session_state.final_job = None if DRAFT_PREVIEW else st.session_state.render_job
+                                if st.session_state.render_job is None:
+                                    st.warning(queue_full_message("render"))
+                            elif not render_busy:
                                 st.error("AI failed to return valid code.")
                     except Exception as e: 
                         st.error(f"Error: {e}")
+
+        # --- RENDER STATUS & PREVIEW ---
+        render_job = st.session_state.get("render_job")
+        if render_job:
+            if not render_job["future"].done():
+                job_status_panel("render_job")
+            else:
+                try:
+                    rendered, render_log, cache_hit = render_job["future"].result()
+                    if not rendered:
+                        st.error("Render Failed")
+                        with st.expander("Show Technical Error Logs"):
+                            st.code(render_log)
+                    else:
+                        if cache_hit:
+                            st.caption("Loaded from render cache.")
+                        if DRAFT_PREVIEW:
+                            st.caption(f"Draft preview ($fn capped at {DRAFT_FN}). Downloads and slicing use the full-resolution part.")
+                        stl_from_file(workspace_file(PREVIEW_STL), color='#58a6ff')
+                except Exception as e:
+                    st.error(f"Render Error: {e}")
         
         # --- DOWNLOAD & PRINT SECTION ---
-        if st.session_state.get('last_code') and os.path.exists("part.stl"):
+        preview_path = workspace_file(PREVIEW_STL)
+        stl_path = workspace_file("part.stl")
+        gcode_path = workspace_file("part.gcode")
+        if st.session_state.get('last_code') and preview_path and os.path.exists(preview_path):
             st.markdown("---")
             d1, d2 = st.columns(2)
-            with open("part.stl", "rb") as file:
-                stl_data = file.read()
-                d1.download_button(label="Download STL", data=stl_data, file_name="part.stl", use_container_width=True)
+            final_job = st.session_state.get("final_job")
+            if os.path.exists(stl_path):
+                with open(stl_path, "rb") as file:
+                    stl_data = file.read()
+                    d1.download_button(label="Download STL", data=stl_data, file_name="part.stl", use_container_width=True)
+            elif final_job and not final_job["future"].done():
+                d1.button("Preparing STL...", disabled=True, use_container_width=True)
+            elif d1.button("Prepare STL Download", use_container_width=True):
+                if queue_final_render():
+                    st.rerun()
             if d2.button("Prepare for Print", use_container_width=True):
                 st.session_state.show_slicing_menu = True
 
+            # Full-resolution render status (drives both the download and any waiting slice)
+            final_job = st.session_state.get("final_job")
+            if final_job and final_job is not st.session_state.get("render_job"):
+                if not final_job["future"].done():
+                    job_status_panel("final_job")
+                elif final_job["future"].exception() is not None or not final_job["future"].result()[0]:
+                    st.error("Full-resolution render failed.")
+                    with st.expander("Show Technical Error Logs"):
+                        error = final_job["future"].exception()
+                        st.code(str(error) if error else final_job["future"].result()[1])
+
 
 
             # --- DYNAMIC SLICING MENU ---
             if st.session_state.get("show_slicing_menu", False):
                 st.markdown("### Slicing Engine")
                 fleet_df = get_my_fleet()
+                fleet_mode = len(fleet_df) > 1 and st.toggle("Slice for all compatible printers")
                 
                 if fleet_df.empty:
                     st.warning("No printers found. Please add a printer in your Profile first.")
+                elif fleet_mode:
+                    # The draft preview is close enough to the final part for a bed-fit check
+                    part_size = get_part_size(preview_path, os.stat(preview_path).st_mtime_ns)
+                    targets, skipped = build_fleet_targets(fleet_df, part_size)
+                    if skipped:
+                        st.caption("Skipped: " + ", ".join(f"{name} ({reason})" for name, reason in skipped))
+
+                    if st.button(f"Generate G-Code for {len(targets)} Printers", use_container_width=True, disabled=not targets):
+                        # Slicing needs the full-resolution STL, so queue it first if needed
+                        if queue_final_render():
+                            control = new_slice_control(total=len(targets))
+                            st.session_state.pending_slice = {
+                                "job_key": "fleet_job",
+                                "printer": None,
+                                "fn": slice_fleet,
+                                "args": (stl_path, st.session_state.generation_dir, targets, control),
+                                "control": control,
+                            }
                 else:
                     selected_p = st.selectbox("Select Destination Printer:", fleet_df['printer nickname'].tolist())
                     p_settings = fleet_df[fleet_df['printer nickname'] == selected_p].iloc[0]
@@ -912,27 +3607,118 @@ elif st.session_state.page == "Make a Part":
                     printer_display = f"{p_settings['brand']} {p_settings['model']} ({p_settings['material']})"
                     st.info(f"**{printer_display}**")
 
+                    recipe = get_recipe(printer_slice_settings(p_settings)[0])
+                    if recipe is None:
+                        st.warning("No verified slicing recipe for this printer/material/nozzle yet.")
+                    else:
+                        part_size = get_part_size(preview_path, os.stat(preview_path).st_mtime_ns)
+                        fits, reason = part_fits_recipe(part_size, recipe) if part_size else (True, "")
+                        if not fits:
+                            st.warning(f"This part may not fit on {selected_p}: {reason}.")
+
                     if st.button("Generate G-Code (Slice)", use_container_width=True):
-                        with st.spinner(f"Slicing for {selected_p}..."):
-                            # Ensure we match the file naming convention exactly
-                            hardware_name = f"{p_settings['brand']} {p_settings['model']} {p_settings['material']} {p_settings['nozzle size']}mm"
-                            
-                            overrides = {
-                                "infill": str(p_settings['infil']).replace('%', ''),
-                                "walls": int(p_settings.get('wall count', 3)),
-                                "supports": p_settings['supports']
+                        hardware_name, overrides = printer_slice_settings(p_settings)
+                        
+                        # Slicing needs the full-resolution STL, so queue it first if needed
+                        if queue_final_render():
+                            control = new_slice_control()
+                            st.session_state.pending_slice = {
+                                "job_key": "slice_job",
+                                "printer": selected_p,
+                                "fn": run_slicing_workflow,
+                                "args": (stl_path, gcode_path, hardware_name, overrides, p_settings, control),
+                                "control": control,
                             }
-                            
-                            # Make sure p_settings exists in your session state or local variables
-                            success, result = run_slicing_workflow("part.stl", "part.gcode", hardware_name, overrides, p_settings)
+
+                pending_slice = st.session_state.get("pending_slice")
+                if pending_slice:
+                    final_job = st.session_state.get("final_job")
+                    if final_job and not final_job["future"].done():
+                        st.caption("Waiting for the full-resolution STL before slicing...")
+                    else:
+                        st.session_state.pending_slice = None
+                        if final_job and final_job["future"].exception() is None and final_job["future"].result()[0]:
+                            job = submit_stage_job("slice", pending_slice["fn"], *pending_slice["args"])
+                            if job is None:
+                                st.warning(queue_full_message("slice"))
+                            else:
+                                job["printer"] = pending_slice["printer"]
+                                job["control"] = pending_slice["control"]
+                                st.session_state[pending_slice["job_key"]] = job
+
+                fleet_job = st.session_state.get("fleet_job")
+                if fleet_job and fleet_mode:
+                    if not fleet_job["future"].done():
+                        job_status_panel("fleet_job")
+                    else:
+                        try:
+                            fleet_results = fleet_job["future"].result()
+                        except CancelledError:
+                            fleet_results = []
+                        except Exception as e:
+                            fleet_results = []
+                            st.error(f"Fleet slicing failed: System Error: {e}")
+
+                        if fleet_job["control"]["cancel"].is_set():
+                            st.info("Fleet slicing cancelled.")
+
+                        sliced = [r for r in fleet_results if r["success"]]
+                        if fleet_results:
+                            st.dataframe(fleet_comparison_table(fleet_results), hide_index=True, use_container_width=True)
+                        if sliced:
+                            fastest = min(
+                                sliced,
+                                key=lambda r: r["result"]["time_seconds"] if r["result"]["time_seconds"] is not None else float("inf")
+                            )
+                            st.success(f"Fastest: **{fastest['printer']}** ({fastest['result']['time']})")
+
+                            pick = st.selectbox("Download G-Code For:", [r["printer"] for r in sliced])
+                            picked = next(r for r in sliced if r["printer"] == pick)
+                            with open(picked["gcode_path"], "rb") as g_file:
+                                st.download_button(
+                                    "Download G-Code", 
+                                    data=g_file, 
+                                    file_name=f"{pick}_part.gcode", 
+                                    use_container_width=True
+                                )
+
+                if not fleet_df.empty and not fleet_mode:
+                    slice_job = st.session_state.get("slice_job")
+                    if slice_job and slice_job.get("printer") == selected_p:
+                        if not slice_job["future"].done():
+                            job_status_panel("slice_job")
+                        else:
+                            try:
+                                success, result = slice_job["future"].result()
+                            except CancelledError:
+                                success, result = False, SLICE_CANCELLED
+                            except Exception as e:
+                                success, result = False, f"System Error: {e}"
                             
                             if success:
                                 st.success("Slicing Complete!")
                                 m1, m2, m3 = st.columns(3)
                                 m1.metric("Est. Time", result["time"])
+                                if result["filament_g"] is not None:
+                                    m2.metric("Filament", f"{result['filament_g']:.1f} g")
                                 m3.metric("Est. Finish", result['finish_time'])
+
+                                details = []
+                                if result["layer_count"]:
+                                    details.append(f"{result['layer_count']} layers")
+                                if result["max_layer_z"]:
+                                    details.append(f"{result['max_layer_z']:.2f} mm tall")
+                                if result["filament_mm"]:
+                                    details.append(f"{result['filament_mm'] / 1000:.2f} m of filament")
+                                if result["filament_cost"]:
+                                    details.append(f"material cost {result['filament_cost']:.2f}")
+                                if details:
+                                    st.caption(" | ".join(details))
+
+                                with st.expander("Layer Analysis"):
+                                    show_gcode_analysis(gcode_path, result["config"], result["time_seconds"])
                                 
-                                with open("part.gcode", "rb") as g_file:
+                                with open(gcode_path, "rb") as g_file:
                                     # The primary action button
                                     st.download_button(
                                         "Download G-Code", 
@@ -948,6 +3734,8 @@ elif st.session_state.page == "Make a Part":
                                     disabled=True, 
                                     help="This function is under development"
                                 )
+                            elif result == SLICE_CANCELLED:
+                                st.info("Slicing cancelled.")
                             else:
                                 st.error(f"Slicing failed: {result}")
 
@@ -1209,21 +3997,17 @@ elif st.session_state.page == "Profile":
             selection = st.selectbox("Select a printer to manage or add a new one:", options)
 
             is_new = (selection == "+ Add New Printer")
-            verified_list = get_verified_recipes()
 
             # 1. INITIALIZE DATA (DYNAMIC LOGIC)
             if is_new:
                 st.info("Configuring a new printer for your fleet.")
                 
                 # Dynamic Brand Selection based on available .ini files
-                available_brands = sorted(list(set([f.split(' ')[0] for f in verified_list])))
+                available_brands = recipe_brands()
                 p_brand = st.selectbox("Printer Brand", available_brands if available_brands else ["No Profiles Found"])
                 
                 # Dynamic Model Selection based on Brand
-                available_models = sorted(list(set([
-                    f.split(f"{p_brand} ")[1].split(' ')[0] 
-                    for f in verified_list if f.startswith(p_brand)
-                ])))
+                available_models = recipe_models(p_brand)
                 p_model = st.selectbox("Model", available_models if available_models else ["Standard/Generic"])
                 
                 init_nickname = ""
@@ -1251,11 +4035,12 @@ elif st.session_state.page == "Profile":
                     init_infill = 15
 
             # 2. FILTER VALID RECIPES for chosen Brand/Model
-            prefix = f"{p_brand} {p_model}"
             m_all = ["PLA", "PETG", "ABS", "ASA", "Nylon", "TPU"]
-            m_valid = [m for m in m_all if any(f"{prefix} {m}" in r for r in verified_list)]
+            m_recipes = recipe_materials(p_brand, p_model)
+            m_valid = [m for m in m_all if m in m_recipes]
             n_all = [0.2, 0.4, 0.6, 0.8]
-            n_valid = [n for n in n_all if any(f"{n}mm" in r and prefix in r for r in verified_list)]
+            n_recipes = recipe_nozzles(p_brand, p_model)
+            n_valid = [n for n in n_all if n in n_recipes]
 
             # 3. UNIFIED FORM
             with st.form("printer_config_form"):
@@ -1341,7 +4126,7 @@ elif st.session_state.page == "Admin":
     
     try:
         # Pull from the "Pending" tab for review
-        df = conn.read(worksheet="Pending", ttl=0)
+        df = read_sheet("Pending")
     except Exception as e:
         st.error(f"Could not connect to 'Pending' sheet: {e}")
         st.stop()
@@ -1363,14 +4148,90 @@ elif st.session_state.page == "Admin":
     with undo_col:
         if st.session_state.get('last_deleted_row'):
             if st.button("Undo Last Entry", width="stretch"):
-                restored_row = pd.DataFrame([st.session_state.last_deleted_row])
-                updated_df = pd.concat([df, restored_row], ignore_index=True)
-                conn.update(worksheet="Pending", data=updated_df)
+                queue_sheet_op("Pending", {"kind": "append", "rows": [st.session_state.last_deleted_row]})
                 st.session_state.last_deleted_row = None
                 st.cache_data.clear()
                 st.success("Entry Restored to Pending!")
                 st.rerun()
 
+    # --- CACHE STATISTICS ---
+    with st.expander("Cache Statistics"):
+        counts = dict(get_cache_counters()["counts"])
+        if counts:
+            st.dataframe(
+                pd.DataFrame(
+                    [{"Counter": name.replace("_", " ").title(), "Value": value} for name, value in sorted(counts.items())]
+                ),
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.caption("No cache activity since the server started.")
+
+        queued_writes, sheet_error = pending_sheet_writes()
+        st.caption(f"Sheet writes waiting to flush: {queued_writes}")
+        if sheet_error:
+            st.warning(f"Last sheet flush failed (will retry): {sheet_error}")
+
+        failed_writes = failed_sheet_writes()
+        if failed_writes:
+            st.error(f"{len(failed_writes)} sheet writes could not be applied and were set aside.")
+            st.dataframe(
+                pd.DataFrame([{
+                    "Time": datetime.fromtimestamp(letter["at"]).strftime("%Y-%m-%d %H:%M:%S"),
+                    "Sheet": letter["sheet"][1] or "Registry",
+                    "Write": letter["op"]["kind"],
+                    "Row": json.dumps(letter["op"].get("match", "")),
+                    "Error": letter["error"],
+                } for letter in failed_writes]),
+                hide_index=True,
+                use_container_width=True
+            )
+            dl_col1, dl_col2 = st.columns(2)
+            if dl_col1.button("Retry Failed Writes", width="stretch"):
+                requeue_failed_sheet_writes()
+                st.rerun()
+            if dl_col2.button("Discard Failed Writes", width="stretch"):
+                discard_failed_sheet_writes()
+                st.rerun()
+
+        mirror = get_sheet_mirror()
+        if mirror["last_sync"]:
+            st.caption(
+                f"Sheets mirror synced {int(time.time() - mirror['last_sync'])}s ago "
+                f"({mirror['syncs']} syncs, {mirror['rows_written']} rows written locally)"
+            )
+        if mirror["last_error"]:
+            st.warning(f"Last sheet sync failed: {mirror['last_error']}")
+        if st.button("Sync Sheets Now", width="stretch"):
+            sync_all_sheets(mirror, conn)
+            invalidate_registry()
+            st.cache_data.clear()
+            st.rerun()
+
+    # --- RECIPE TRANSLATOR ---
+    with st.expander("Recipe Translator (Bambu/Orca to Prusa)"):
+        st.caption(f"Applies '{RECIPE_TRANSLATION_TABLE}' to every .ini in a folder and checks the keys against {RECIPE_REFERENCE}.")
+        tr_src = st.text_input("Exported Profiles Folder", placeholder="e.g. exports/orca")
+        tr_out = st.text_input("Output Folder", value=RECIPE_DIR)
+        tr_col1, tr_col2 = st.columns(2)
+        tr_drop = tr_col1.checkbox("Drop keys PrusaSlicer doesn't know")
+        tr_overwrite = tr_col2.checkbox("Overwrite existing recipes")
+
+        if st.button("Translate Folder", width="stretch", disabled=not tr_src):
+            if not os.path.isdir(tr_src):
+                st.error(f"Folder not found: {tr_src}")
+            else:
+                try:
+                    tr_rows = translate_recipe_directory(tr_src, tr_out, tr_drop, tr_overwrite)
+                except OSError as e:
+                    st.error(f"Translation failed: {e}")
+                else:
+                    if tr_rows:
+                        st.dataframe(pd.DataFrame(tr_rows), hide_index=True, use_container_width=True)
+                    else:
+                        st.info("No .ini profiles found in that folder.")
+
     st.markdown("---")
 
     if df.empty or len(df) == 0:
@@ -1405,10 +4266,16 @@ elif st.session_state.page == "Admin":
         with col_edit:
             st.markdown("#### Data")
             
-            # --- BASE64 IMAGE DISPLAY ---
-            # We look at the same column, but treat it as a data string now
+            # --- SKETCH DISPLAY ---
+            # Only the selected row's image is loaded; new rows hold a blob reference, older ones base64
             img_b64 = row.get('Image_File', "")
-            if img_b64 and str(img_b64) != "nan" and img_b64 != "":
+            sketch_path = blob_path(img_b64)
+            if sketch_path:
+                if os.path.exists(sketch_path):
+                    st.image(sketch_path, caption="Reference Sketch", use_container_width=True)
+                else:
+                    st.caption("The sketch for this entry isn't in this server's data folder (NAPKIN_DATA_DIR).")
+            elif img_b64 and str(img_b64) != "nan" and img_b64 != "":
                 try:
                     # Streamlit handles the data URI prefix automatically
                     st.image(f"data:image/jpeg;base64,{img_b64}", caption="Reference Sketch (Stored in Sheet)", use_container_width=True)
@@ -1428,27 +4295,20 @@ elif st.session_state.page == "Admin":
                 if st.session_state.get('confirm_save') == selection:
                     if st.button("CONFIRM SAVE", type="primary", width="stretch"):
                         try:
-                            try:
-                                corrected_df = conn.read(worksheet="Corrected", ttl=0)
-                            except:
-                                corrected_df = pd.DataFrame(columns=["Status", "Timestamp", "Prompt", "Logic", "Code", "Image_File"])
-
-                            new_row = pd.DataFrame([{
+                            new_row = {
                                 "Status": "CORRECTED",
                                 "Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
                                 "Prompt": edit_prompt,
                                 "Logic": edit_logic,
                                 "Code": edit_code.replace("\n", " [NEWLINE] "),
-                                "Image_File": row.get('Image_File', "") # Carry the Base64 string over
-                            }])
+                                "Image_File": row.get('Image_File', "") # Carry the blob reference (or legacy Base64) over
+                            }
                             
-                            updated_corrected = pd.concat([corrected_df, new_row], ignore_index=True)
-                            conn.update(worksheet="Corrected", data=updated_corrected)
-
-                            updated_pending = df.drop(df.index[selection])
-                            conn.update(worksheet="Pending", data=updated_pending)
+                            queue_sheet_op("Corrected", {"kind": "append", "rows": [new_row]})
+                            queue_sheet_op("Pending", {"kind": "delete", "match": pending_row_match(row), "limit": 1})
 
                             sync_scad_from_sheets()
+                            add_training_example(edit_prompt, edit_logic, edit_code)
 
                             st.session_state.confirm_save = None
                             st.session_state.admin_index = 0 
@@ -1475,8 +4335,7 @@ elif st.session_state.page == "Admin":
                         row_to_delete = df.iloc[selection]
                         
                         st.session_state.last_deleted_row = row_to_delete.to_dict()
-                        updated_df = df.drop(df.index[selection])
-                        conn.update(worksheet="Pending", data=updated_df)
+                        queue_sheet_op("Pending", {"kind": "delete", "match": pending_row_match(row_to_delete), "limit": 1})
                         
                         st.session_state.confirm_delete = None
                         st.session_state.admin_index = 0
@@ -0,0 +1,63 @@
+"""
+Benchmarks the parallel candidate + repair loop with a fake Gemini client and a stub
+renderer, so no API key or OpenSCAD install is needed.
+
+    python tests/bench_candidates.py --latency 1.5 --render 0.5 --fail-rate 0.4 --trials 20
+"""
+import argparse
+import logging
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from fakes import FakeClient
+from helpers import load_main
+
+REPLY = "[DECODED LOGIC]: A cube.\n[RESULT_CODE]: ```openscad\ncube(10);\n```"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=1.0, help="Seconds per fake model call")
+    parser.add_argument("--render", type=float, default=0.3, help="Seconds per stub render")
+    parser.add_argument("--fail-rate", type=float, default=0.4, help="Chance a stub render fails")
+    parser.add_argument("--trials", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    gen = load_main(
+        "GEMINI_MODEL", "SCAD_BLOCK_RE", "extract_decoded_logic", "generate_scad",
+        "MAX_CANDIDATES", "REPAIR_ATTEMPTS", "RENDER_QUEUE_FULL", "RENDER_BUSY_RETRIES", "RENDER_BUSY_WAIT",
+        "get_candidate_executor", "repair_contents", "run_candidate", "generate_with_candidates",
+        STREAM_GENERATION=False,
+    )
+    # Worker threads have no Streamlit session here; that is expected, so keep the output readable
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+    rng = random.Random(args.seed)
+    rng_lock = threading.Lock()
+
+    def stub_render(code, scad_path, stl_path):
+        time.sleep(args.render)
+        with rng_lock:
+            failed = rng.random() < args.fail_rate
+        return (False, "ERROR: stub render failure", False) if failed else (True, "", False)
+
+    print(f"{'Candidates':>10} {'Mean s':>8} {'p90 s':>8} {'Success':>8} {'Model calls':>12}")
+    for count in range(1, gen["MAX_CANDIDATES"] + 1):
+        times, wins, calls = [], 0, 0
+        for _ in range(args.trials):
+            client = FakeClient(reply=lambda contents: REPLY, latency=args.latency)
+            with tempfile.TemporaryDirectory() as workspace:
+                started = time.perf_counter()
+                result = gen["generate_with_candidates"](client, ["prompt"], stub_render, workspace, count)
+                times.append(time.perf_counter() - started)
+            wins += bool(result["code"])
+            calls += client.models.calls
+        p90 = sorted(times)[int(0.9 * (len(times) - 1))]
+        print(f"{count:>10} {statistics.mean(times):>8.2f} {p90:>8.2f} {wins / args.trials:>8.0%} {calls / args.trials:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Local stand-ins for the google-genai client, shaped like client.models.generate_content(_stream)."""
+import threading
+import time
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModels:
+    def __init__(self, chunks=None, reply=None, latency=0.0):
+        """
+        chunks: the streamed response, one string per chunk.
+        reply: callable(contents) -> full response text for generate_content; defaults to "".join(chunks).
+        latency: seconds each call (or chunk) takes, to make benchmarks look like a real model.
+        """
+        self.chunks = list(chunks or [])
+        self.reply = reply
+        self.latency = latency
+        self.chunks_read = 0
+        self.calls = 0
+        self.stream_calls = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, model, contents):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        text = self.reply(contents) if self.reply else "".join(self.chunks)
+        return FakeResponse(text)
+
+    def generate_content_stream(self, model, contents):
+        with self.lock:
+            self.stream_calls += 1
+        for chunk in self.chunks:
+            time.sleep(self.latency)
+            self.chunks_read += 1
+            yield FakeResponse(chunk)
+
+
+class FakeClient:
+    def __init__(self, **kwargs):
+        self.models = FakeModels(**kwargs)
@@ -0,0 +1,45 @@
+"""
+main.py is a Streamlit script, so importing it would start the whole app.
+load_main() pulls named top-level definitions out of it instead, so single
+functions can be tested without Streamlit sessions, Sheets or Gemini keys.
+"""
+import ast
+import os
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+
+def defined_name(node):
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        return node.name
+    if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+        return node.targets[0].id
+    return None
+
+
+def load_main(*names, **overrides):
+    """
+    Runs main.py's imports plus the given functions/constants in a fresh namespace.
+    Imports that aren't installed here are skipped. overrides replace names both
+    before and after the definitions run (e.g. to stub out a helper).
+    """
+    with open(MAIN_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), MAIN_PATH)
+
+    namespace = {"__name__": "napkin_main"}
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            try:
+                exec(compile(ast.Module([node], []), MAIN_PATH, "exec"), namespace)
+            except ImportError:
+                pass
+
+    wanted = [node for node in tree.body if defined_name(node) in names]
+    missing = set(names) - {defined_name(node) for node in wanted}
+    if missing:
+        raise LookupError(f"Not defined at the top level of main.py: {sorted(missing)}")
+
+    namespace.update(overrides)
+    exec(compile(ast.Module(wanted, []), MAIN_PATH, "exec"), namespace)
+    namespace.update(overrides)
+    return namespace
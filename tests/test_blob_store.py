@@ -0,0 +1,28 @@
+import base64
+import hashlib
+
+from helpers import load_main
+
+NAMES = ("BLOB_PREFIX", "blob_path", "store_blob")
+
+
+def blob_store(**overrides):
+    return load_main(*NAMES, bump_cache_counter=lambda name, amount=1: None, **overrides)
+
+
+def test_sketch_stays_in_the_sheet_without_durable_storage(tmp_path):
+    store = blob_store(BLOB_DIR=str(tmp_path / "blobs"), BLOB_DURABLE=False)
+
+    assert store["store_blob"](b"sketch") == base64.b64encode(b"sketch").decode("ascii")
+    assert not (tmp_path / "blobs").exists()
+
+
+def test_durable_store_writes_each_sketch_once(tmp_path):
+    store = blob_store(BLOB_DIR=str(tmp_path / "blobs"), BLOB_DURABLE=True)
+
+    ref = store["store_blob"](b"sketch")
+
+    assert ref == "blob:" + hashlib.sha256(b"sketch").hexdigest()
+    assert store["store_blob"](b"sketch") == ref
+    with open(store["blob_path"](ref), "rb") as f:
+        assert f.read() == b"sketch"
@@ -0,0 +1,60 @@
+from fakes import FakeClient
+from helpers import load_main
+
+REPLY = "[DECODED LOGIC]: A cube.\n[RESULT_CODE]: ```openscad\ncube(10);\n```"
+
+
+def candidates(**overrides):
+    return load_main(
+        "GEMINI_MODEL", "SCAD_BLOCK_RE", "extract_decoded_logic", "generate_scad",
+        "MAX_CANDIDATES", "REPAIR_ATTEMPTS", "RENDER_QUEUE_FULL", "RENDER_BUSY_RETRIES", "RENDER_BUSY_WAIT",
+        "get_candidate_executor", "repair_contents", "run_candidate", "generate_with_candidates",
+        STREAM_GENERATION=False, RENDER_BUSY_WAIT=0.0, **overrides
+    )
+
+
+def test_full_render_queue_never_reaches_the_model(tmp_path):
+    gen = candidates()
+    client = FakeClient(reply=lambda contents: REPLY)
+    renders = []
+
+    def busy_render(code, scad_path, stl_path):
+        renders.append(code)
+        return False, gen["RENDER_QUEUE_FULL"], False
+
+    result = gen["generate_with_candidates"](client, ["prompt"], busy_render, str(tmp_path), 2)
+
+    assert result["code"] is None
+    assert result["error"] == gen["RENDER_QUEUE_FULL"]
+    # One generation per candidate and no repair calls, only render retries
+    assert client.models.calls == 2
+    assert len(renders) == 2 * (gen["RENDER_BUSY_RETRIES"] + 1)
+
+
+def test_busy_render_is_resubmitted_until_a_slot_frees(tmp_path):
+    gen = candidates()
+    client = FakeClient(reply=lambda contents: REPLY)
+    outcomes = [(False, gen["RENDER_QUEUE_FULL"], False)] * 2 + [(True, "", False)]
+
+    result = gen["generate_with_candidates"](client, ["prompt"], lambda *args: outcomes.pop(0), str(tmp_path), 1)
+
+    assert result["code"] == "cube(10);"
+    assert client.models.calls == 1
+
+
+def test_render_error_is_sent_back_for_repair(tmp_path):
+    gen = candidates()
+    prompts = []
+
+    def reply(contents):
+        prompts.append(contents)
+        return REPLY
+
+    client = FakeClient(reply=reply)
+    outcomes = [(False, "ERROR: Parser error in line 1", False), (True, "", False)]
+
+    result = gen["generate_with_candidates"](client, ["prompt"], lambda *args: outcomes.pop(0), str(tmp_path), 1)
+
+    assert result["code"] == "cube(10);"
+    assert result["attempts"] == 2
+    assert "ERROR: Parser error in line 1" in prompts[1][-1]
@@ -0,0 +1,48 @@
+from fakes import FakeClient
+from helpers import load_main
+
+GEN = load_main("GEMINI_MODEL", "STREAM_GENERATION", "SCAD_BLOCK_RE", "extract_decoded_logic", "generate_scad")
+
+CHUNKS = [
+    "[DECODED LOGIC]: A plate",
+    " with two holes",
+    ".\n[CODE]:\n```openscad\ndifference() {\n  cube([20, 10, 2]);\n",
+    "}\n```",
+    "\nAnything after the fence should never be read.",
+]
+
+
+def test_stream_reports_logic_as_it_grows():
+    seen = []
+    client = FakeClient(chunks=CHUNKS)
+
+    GEN["generate_scad"](client, ["prompt"], on_logic=seen.append, stream=True)
+
+    assert seen == ["A plate", "A plate with two holes", "A plate with two holes."]
+
+
+def test_stream_stops_at_closing_fence():
+    client = FakeClient(chunks=CHUNKS)
+
+    code, logic = GEN["generate_scad"](client, ["prompt"], stream=True)
+
+    assert code == "difference() {\n  cube([20, 10, 2]);\n}"
+    assert logic == "A plate with two holes."
+    assert client.models.chunks_read == 4
+
+
+def test_non_streaming_fallback():
+    client = FakeClient(chunks=CHUNKS)
+
+    code, logic = GEN["generate_scad"](client, ["prompt"], on_logic=lambda text: None, stream=False)
+
+    assert code == "difference() {\n  cube([20, 10, 2]);\n}"
+    assert logic == "A plate with two holes."
+    assert client.models.calls == 1
+    assert client.models.stream_calls == 0
+
+
+def test_missing_code_block_returns_none():
+    client = FakeClient(chunks=["[DECODED LOGIC]: No idea", "\n[CODE]: sorry"])
+
+    assert GEN["generate_scad"](client, ["prompt"], stream=True) == (None, "No idea")
@@ -0,0 +1,25 @@
+import os
+import threading
+
+from helpers import load_main
+
+NAMES = (
+    "RECIPE_KEY_ALIASES", "parse_recipe_file", "split_recipe_line", "first_recipe_value", "parse_bed_shape",
+    "parse_recipe_name", "build_recipe_entry", "get_library_signature", "get_recipe_catalog",
+)
+
+
+def test_recipe_overwritten_in_place_is_picked_up(tmp_path):
+    store = {"lock": threading.Lock(), "stamp": None, "recipes": {}, "index": {}}
+    catalog = load_main(*NAMES, RECIPE_DIR=str(tmp_path), get_recipe_store=lambda: store)
+    recipe = tmp_path / "Creality Ender-3 PLA 0.4mm.ini"
+    recipe.write_text("filament_type = PLA\n")
+    assert catalog["get_recipe_catalog"]()["recipes"]["Creality Ender-3 PLA 0.4mm"]["filament_type"] == "PLA"
+
+    # Rewriting an existing file (like the translator's overwrite) leaves the folder's mtime alone
+    folder_times = os.stat(tmp_path).st_atime_ns, os.stat(tmp_path).st_mtime_ns
+    recipe.write_text("filament_type = PETG\n")
+    os.utime(recipe, ns=(folder_times[0], folder_times[1] + 1))
+    os.utime(tmp_path, ns=folder_times)
+
+    assert catalog["get_recipe_catalog"]()["recipes"]["Creality Ender-3 PLA 0.4mm"]["filament_type"] == "PETG"
@@ -0,0 +1,172 @@
+from collections import deque
+import threading
+
+import pandas as pd
+
+from helpers import load_main
+
+WRITER = load_main(
+    "SHEET_RETRY_SECONDS", "SHEET_RETRY_MAX_SECONDS", "SHEET_MAX_RETRIES",
+    "sheet_column", "sheet_row_mask", "apply_sheet_op", "apply_sheet_ops", "sheet_cell_text",
+    "sheet_fingerprint", "dead_letter_sheet_ops", "sheet_io_kwargs", "take_due_sheet_batches",
+    "flush_sheet_batch", "flush_sheet_writes", "unwritten_sheet_ops", "read_sheet",
+    bump_cache_counter=lambda name, amount=1: None,
+    mirror_store=lambda spreadsheet, worksheet, df: 1,
+    get_sheet_mirror=lambda: MIRROR,
+)
+KEY = ("registry", None)
+MIRROR = {"store_lock": threading.Lock(), "versions": {}, "last_error": None}
+
+
+class FakeSheets:
+    """One worksheet behind GSheetsConnection's read/update. fail_update can raise before or after the write lands."""
+    def __init__(self, df, fail_update=None):
+        self.df = df
+        self.fail_update = fail_update
+        self.updates = 0
+
+    def read(self, ttl=0, **kwargs):
+        return self.df.copy()
+
+    def update(self, data, **kwargs):
+        self.updates += 1
+        if self.fail_update == "before":
+            raise TimeoutError("update timed out")
+        self.df = data.copy()
+        if self.fail_update == "after":
+            self.fail_update = None
+            raise TimeoutError("update timed out")
+
+
+def new_writer(*ops):
+    return {
+        "lock": threading.Lock(), "pending": {KEY: list(ops)} if ops else {}, "inflight": {},
+        "retry": {}, "dead_letters": deque(maxlen=200), "last_error": None,
+    }
+
+
+def registry():
+    return pd.DataFrame({"email": ["a@x.com", "b@x.com"], "printers": [1, 4]})
+
+
+def increment(email, amount=1):
+    return {"kind": "increment", "match": {"email": email}, "column": "printers", "amount": amount}
+
+
+def test_batch_is_written_once():
+    sheets = FakeSheets(registry())
+    writer = new_writer(increment("a@x.com", 2), {"kind": "append", "rows": [{"email": "c@x.com", "printers": 0}]})
+
+    WRITER["flush_sheet_writes"](writer, sheets)
+
+    assert sheets.updates == 1
+    assert sheets.df["printers"].tolist() == [3, 4, 0]
+    assert writer["inflight"] == {} and writer["retry"] == {}
+
+
+def test_unknown_column_is_dead_lettered_without_blocking_the_rest():
+    sheets = FakeSheets(registry())
+    typo = {"kind": "update", "match": {"email": "a@x.com"}, "values": {"nozle size": "0.6"}}
+    writer = new_writer(typo, increment("b@x.com"))
+
+    WRITER["flush_sheet_writes"](writer, sheets)
+
+    assert list(sheets.df.columns) == ["email", "printers"]
+    assert sheets.df["printers"].tolist() == [1, 5]
+    assert [letter["op"] for letter in writer["dead_letters"]] == [typo]
+    assert "nozle size" in writer["dead_letters"][0]["error"]
+
+
+def test_failed_update_backs_off_then_dead_letters():
+    sheets = FakeSheets(registry(), fail_update="before")
+    writer = new_writer(increment("a@x.com"))
+
+    WRITER["flush_sheet_writes"](writer, sheets)
+    retry = writer["retry"][KEY]
+    assert retry["attempts"] == 1
+    assert retry["next_at"] > 0
+
+    # Not due yet, so nothing is retried
+    WRITER["flush_sheet_writes"](writer, sheets)
+    assert sheets.updates == 1
+
+    for _ in range(WRITER["SHEET_MAX_RETRIES"] - 1):
+        WRITER["flush_sheet_writes"](writer, sheets, force=True)
+
+    assert sheets.updates == WRITER["SHEET_MAX_RETRIES"]
+    assert writer["retry"] == {}
+    assert len(writer["dead_letters"]) == 1
+    assert sheets.df["printers"].tolist() == [1, 4]
+
+
+def test_update_that_landed_before_failing_is_not_replayed():
+    sheets = FakeSheets(registry(), fail_update="after")
+    writer = new_writer(increment("a@x.com"), {"kind": "append", "rows": [{"email": "c@x.com", "printers": 0}]})
+
+    WRITER["flush_sheet_writes"](writer, sheets)
+    assert KEY in writer["retry"]
+
+    # A click made while the batch was backing off still goes out with the retry
+    writer["pending"][KEY] = [increment("b@x.com")]
+    WRITER["flush_sheet_writes"](writer, sheets, force=True)
+
+    assert sheets.df["email"].tolist() == ["a@x.com", "b@x.com", "c@x.com"]
+    assert sheets.df["printers"].tolist() == [2, 5, 0]
+    assert writer["retry"] == {} and not writer["dead_letters"]
+
+
+def test_fingerprint_ignores_sheets_round_trip_types():
+    written = pd.DataFrame({"email": ["a@x.com"], "printers": [3], "notes": [None]})
+    read_back = pd.DataFrame({"email": ["a@x.com"], "printers": [3.0], "notes": [""]})
+
+    assert WRITER["sheet_fingerprint"](written) == WRITER["sheet_fingerprint"](read_back)
+
+
+def test_read_retries_when_a_flush_lands_between_snapshot_and_load(monkeypatch):
+    writer = new_writer(increment("a@x.com"))
+    writer["inflight"], writer["pending"] = writer["pending"], {}
+    flushed = registry()
+    flushed.loc[0, "printers"] = 2
+    loads = []
+
+    def mirror_frame(spreadsheet, worksheet):
+        if not loads:
+            # The flush stores its copy and publishes it right after our snapshot
+            writer["inflight"].pop(KEY)
+            MIRROR["versions"][KEY] = 2
+        loads.append(MIRROR["versions"][KEY])
+        return flushed.copy(), MIRROR["versions"][KEY]
+
+    monkeypatch.setitem(MIRROR["versions"], KEY, 1)
+    monkeypatch.setitem(WRITER, "get_sheet_writer", lambda: writer)
+    monkeypatch.setitem(WRITER, "mirror_has", lambda spreadsheet, worksheet: True)
+    monkeypatch.setitem(WRITER, "mirror_frame", mirror_frame)
+
+    df = WRITER["read_sheet"](None, spreadsheet="registry")
+
+    assert loads == [2, 2]
+    assert df["printers"].tolist() == [2, 4]
+
+
+def test_pending_delete_matches_an_empty_cell_read_back_as_nan():
+    # The mirror hands rows out with None where the sheet itself has NaN
+    pending = pd.DataFrame({"Timestamp": ["2026-01-02 10:00"], "User_Email": ["a@x.com"], "Prompt": [float("nan")]})
+    sheets = FakeSheets(pending)
+    match = {"Timestamp": "2026-01-02 10:00", "User_Email": "a@x.com", "Prompt": None}
+    writer = new_writer({"kind": "delete", "match": match, "limit": 1})
+
+    WRITER["flush_sheet_writes"](writer, sheets)
+
+    assert sheets.df.empty
+    assert not writer["dead_letters"]
+
+
+def test_update_that_matches_no_row_is_dead_lettered():
+    sheets = FakeSheets(registry())
+    ghost = {"kind": "update", "match": {"email": "ghost@x.com"}, "values": {"printers": 9}}
+    writer = new_writer(ghost)
+
+    WRITER["flush_sheet_writes"](writer, sheets)
+
+    assert sheets.updates == 0
+    assert [letter["op"] for letter in writer["dead_letters"]] == [ghost]
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+
+from helpers import MAIN_PATH, load_main
+
+TRANSLATOR = load_main(
+    "RECIPE_KEY_ALIASES", "parse_recipe_file", "split_recipe_line", "load_translation_table",
+    "load_reference_keys", "translate_recipe_text",
+)
+APP_DIR = os.path.dirname(MAIN_PATH)
+
+
+@pytest.fixture
+def rules():
+    table_path = os.path.join(APP_DIR, "Recipe Instruction Document.txt")
+    reference_path = os.path.join(APP_DIR, "config.ini")
+    table = TRANSLATOR["load_translation_table"](table_path, os.stat(table_path).st_mtime_ns)
+    reference_keys = TRANSLATOR["load_reference_keys"](reference_path, os.stat(reference_path).st_mtime_ns)
+    return table, reference_keys
+
+
+def test_orca_values_are_translated(rules):
+    table, reference_keys = rules
+    (find_key, find_value), (new_key, new_value) = next(iter(table.items()))
+
+    text, report = TRANSLATOR["translate_recipe_text"](f"{find_key} = {find_value}\n", table, reference_keys)
+
+    assert text == f"{new_key} = {new_value}\n"
+    assert report["translated"] == [f"{find_key} = {find_value} -> {new_key} = {new_value}"]
+    assert report["unmapped"] == []
+
+
+def test_values_already_in_prusa_form_are_not_unmapped(rules):
+    table, reference_keys = rules
+    prusa_lines = "".join(f"{key} = {value}\n" for key, value in set(table.values()) if key in {k for k, _ in table})
+
+    _, report = TRANSLATOR["translate_recipe_text"](prusa_lines, table, reference_keys)
+
+    assert report["unmapped"] == []
+
+
+def test_translated_recipes_report_nothing_unmapped(rules):
+    table, reference_keys = rules
+    with open(os.path.join(APP_DIR, "recipes", "BambuLab X1-Carbon PLA 0.4mm.ini"), encoding="utf-8") as f:
+        _, report = TRANSLATOR["translate_recipe_text"](f.read(), table, reference_keys)
+
+    assert report["unmapped"] == []
+
+
+def test_unknown_orca_value_is_reported(rules):
+    table, reference_keys = rules
+    key = next(iter(table))[0]
+
+    _, report = TRANSLATOR["translate_recipe_text"](f"{key} = definitely_not_a_value\n", table, reference_keys)
+
+    assert report["unmapped"] == [f"{key} = definitely_not_a_value"]
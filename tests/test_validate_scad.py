@@ -0,0 +1,73 @@
+import pytest
+
+from helpers import load_main
+
+VALIDATOR = load_main(
+    "SCAD_BUILTINS", "SCAD_MULTI_CHAR_PUNCT", "tokenize_scad", "get_library_signature",
+    "build_library_symbols", "build_library_includes", "get_library_symbols", "get_library_includes",
+    "scad_library_dirs", "resolve_scad_include", "validate_scad",
+)
+
+
+@pytest.fixture(autouse=True)
+def app_folder(tmp_path, monkeypatch):
+    """A scratch app folder whose libraries/ has outer.scad -> inner.scad, like a real nested include."""
+    libraries = tmp_path / "libraries"
+    libraries.mkdir()
+    (libraries / "nested_outer.scad").write_text("include <libraries/nested_inner.scad>;\nmodule outer_plate() { cube(1); }\n")
+    (libraries / "nested_inner.scad").write_text("module inner_boss(d) { cylinder(d=d, h=2); }\n")
+    # Includes resolve against the app folder, like render_scad_to_stl does
+    monkeypatch.chdir(tmp_path)
+
+
+def test_len_in_a_range_is_valid():
+    code = "holes = [3, 4, 5];\nfor (i = [0:len(holes)-1])\n  translate([i * 10, 0, 0]) cylinder(d=holes[i], h=2);\n"
+
+    assert VALIDATOR["validate_scad"](code) == ([], [])
+
+
+def test_unknown_call_is_only_a_warning():
+    errors, warnings = VALIDATOR["validate_scad"]("frobnicate(3);\n")
+
+    assert errors == []
+    assert warnings == ["line 1:1: unknown module or function 'frobnicate'"]
+
+
+def test_symbols_from_nested_library_includes_are_known():
+    errors, warnings = VALIDATOR["validate_scad"]("include <libraries/nested_outer.scad>;\ninner_boss(8);\n")
+
+    assert errors == []
+    assert warnings == []
+
+
+def test_library_symbol_without_include_is_an_error():
+    errors, _ = VALIDATOR["validate_scad"]("inner_boss(8);\n")
+
+    assert errors == ["line 1:1: 'inner_boss' is defined in libraries/nested_inner.scad but the code never includes it"]
+
+
+def test_unbalanced_brackets_are_rejected():
+    errors, _ = VALIDATOR["validate_scad"]("cube([1, 2, 3);\n")
+
+    assert errors
+
+
+def test_includes_are_found_on_openscadpath(tmp_path, monkeypatch):
+    mcad = tmp_path / "system" / "MCAD"
+    mcad.mkdir(parents=True)
+    (mcad / "nuts_and_bolts.scad").write_text("module nutHole(size) { cylinder(r=size, h=2); }\n")
+    monkeypatch.setenv("OPENSCADPATH", str(tmp_path / "system"))
+
+    errors, warnings = VALIDATOR["validate_scad"]("use <MCAD/nuts_and_bolts.scad>;\nnutHole(3);\n")
+
+    assert errors == []
+    assert warnings == ["line 2:1: unknown module or function 'nutHole'"]
+
+
+def test_unresolved_include_is_only_a_warning(monkeypatch):
+    monkeypatch.setenv("OPENSCADPATH", "")
+
+    errors, warnings = VALIDATOR["validate_scad"]("include <BOSL2/std.scad>;\ncube(1);\n")
+
+    assert errors == []
+    assert warnings == ["line 1:1: include file <BOSL2/std.scad> not found"]
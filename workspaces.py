@@ -0,0 +1,66 @@
+"""
+Per-session scratch folders, shared by main.py and app.py.
+
+Every session gets its own scratch folder, and every generation a fresh sub-folder,
+so concurrent users never overwrite each other's part.scad / part.stl / part.gcode.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import streamlit as st
+
+# Lives in main.py's CACHE_ROOT, so the cache tooling treats it as disposable too
+WORKSPACE_ROOT = os.path.join(".napkin_cache", "workspaces")
+WORKSPACE_IDLE_SECONDS = 6 * 60 * 60
+WORKSPACE_SWEEP_INTERVAL = 5 * 60
+
+@st.cache_resource
+def get_workspace_sweeper():
+    return {"lock": threading.Lock(), "last_sweep": 0.0}
+
+def sweep_idle_workspaces():
+    """Deletes session folders that haven't been touched for WORKSPACE_IDLE_SECONDS."""
+    sweeper = get_workspace_sweeper()
+    now = time.time()
+    with sweeper["lock"]:
+        if now - sweeper["last_sweep"] < WORKSPACE_SWEEP_INTERVAL:
+            return
+        sweeper["last_sweep"] = now
+
+    if not os.path.exists(WORKSPACE_ROOT):
+        return
+    for fn in os.listdir(WORKSPACE_ROOT):
+        path = os.path.join(WORKSPACE_ROOT, fn)
+        try:
+            if now - os.path.getmtime(path) > WORKSPACE_IDLE_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def get_session_workspace():
+    ws = st.session_state.get("workspace_dir")
+    if not ws or not os.path.isdir(ws):
+        os.makedirs(WORKSPACE_ROOT, exist_ok=True)
+        ws = tempfile.mkdtemp(prefix="session_", dir=WORKSPACE_ROOT)
+        st.session_state.workspace_dir = ws
+    os.utime(ws)  # Keeps active sessions safe from the idle sweep
+    return ws
+
+def new_generation_workspace():
+    """Starts a fresh scratch folder for one generation and removes the previous ones."""
+    ws = get_session_workspace()
+    for fn in os.listdir(ws):
+        shutil.rmtree(os.path.join(ws, fn), ignore_errors=True)
+    gen_dir = tempfile.mkdtemp(prefix="gen_", dir=ws)
+    st.session_state.generation_dir = gen_dir
+    return gen_dir
+
+def workspace_file(filename):
+    """Path of a file in the current generation's folder, or None before the first generation."""
+    gen_dir = st.session_state.get("generation_dir")
+    if not gen_dir or not os.path.isdir(gen_dir):
+        return None
+    return os.path.join(gen_dir, filename)